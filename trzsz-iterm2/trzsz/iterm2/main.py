@@ -186,7 +186,7 @@ def upload_files(args, loop, connection, session, directory, remote_is_windows):
 
     utils.reconfigure_stdin()
 
-    transfer.send_action(True, __version__, remote_is_windows)
+    transfer.send_action(True, __version__, remote_is_windows, len(file_list))
     config = transfer.recv_config()
 
     if config.overwrite is True:
@@ -310,7 +310,7 @@ def drag_files_to_upload(file_paths, loop, session):
 
         has_dir = False
         for file in file_list:
-            if file['is_dir'] or len(file['path_name']) > 1:
+            if file.is_dir or file.node.parent is not None:
                 has_dir = True
                 break
         if has_dir:
@@ -42,6 +42,9 @@ class ZenityProgressBar(utils.TrzszCallback):
 
     def on_num(self, num):
         self.num = num
+        # called again with the new total when the files are received in batches
+        if self.proc:
+            return
         try:
             title = f'{self.action} file(s)'
             # pylint: disable-next=consider-using-with
@@ -0,0 +1,60 @@
+# MIT License
+#
+# Copyright (c) 2023 Lonny Wong <lonnywong@qq.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Measure the throughput of the digests on the transfer path.
+
+Usage: python -m benchmarks.bench_digest [size_in_mb] [chunk_size_in_mb]
+"""
+
+import os
+import sys
+import time
+from .trzsz.libs import utils
+from .trzsz.libs import transfer
+
+
+def measure(digest, chunks, threaded):
+    begin_time = time.time()
+    hasher = utils.new_hasher(digest)
+    if threaded:
+        with transfer.HashWorker(hasher) as worker:
+            for chunk in chunks:
+                worker.update(chunk)
+            worker.digest()
+    else:
+        for chunk in chunks:
+            hasher.update(chunk)
+        hasher.digest()
+    return sum(len(chunk) for chunk in chunks) / 1024.0 / 1024 / max(time.time() - begin_time, 1e-9)
+
+
+def main():
+    size = int(float(sys.argv[1]) * 1024 * 1024) if len(sys.argv) > 1 else 256 * 1024 * 1024
+    chunk_size = int(float(sys.argv[2]) * 1024 * 1024) if len(sys.argv) > 2 else 10 * 1024 * 1024
+    chunks = [os.urandom(chunk_size) for _ in range(max(size // chunk_size, 1))]
+    print('%-10s %14s %14s' % ('digest', 'inline MB/s', 'thread MB/s'))
+    for digest in sorted(utils.DIGEST_FACTORIES):
+        print('%-10s %14.1f %14.1f' % (digest, measure(digest, chunks, False), measure(digest, chunks, True)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+# MIT License
+#
+# Copyright (c) 2023 Lonny Wong <lonnywong@qq.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Measure the escape/unescape throughput of the binary mode.
+
+Usage: python -m benchmarks.bench_escape [size_in_mb]
+"""
+
+import os
+import re
+import sys
+import time
+from .trzsz.libs import utils
+
+
+def regex_escape(data, escape_chars):
+    # the per-chunk regex implementation used before EscapeCodec, kept for comparison
+    pattern = b'|'.join(b'(%s)' % re.escape(p.encode('latin1')) for p, s in escape_chars)
+    substs = [s.encode('latin1') for p, s in escape_chars]
+    return re.sub(pattern, lambda m: substs[m.lastindex - 1], data)
+
+
+def regex_unescape(data, escape_chars):
+    pattern = b'|'.join(b'(%s)' % re.escape(s.encode('latin1')) for p, s in escape_chars)
+    substs = [p.encode('latin1') for p, s in escape_chars]
+    return re.sub(pattern, lambda m: substs[m.lastindex - 1], data)
+
+
+def measure(func, chunks):
+    begin_time = time.time()
+    total = 0
+    for chunk in chunks:
+        total += len(chunk)
+        func(chunk)
+    return total / 1024.0 / 1024 / max(time.time() - begin_time, 1e-9)
+
+
+def main():
+    size = int(float(sys.argv[1]) * 1024 * 1024) if len(sys.argv) > 1 else 16 * 1024 * 1024
+    chunk_size = 1024 * 1024
+    inputs = [
+        ('random', [os.urandom(chunk_size) for _ in range(size // chunk_size)]),
+        ('text', [(b'The quick brown fox jumps over the lazy dog.\n' * (chunk_size // 45 + 1))[:chunk_size]] *
+         (size // chunk_size)),
+    ]
+    escape_sets = [('default', utils.get_escape_chars(False)), ('escape_all', utils.get_escape_chars(True))]
+    print('%-12s %-8s %-8s %12s %12s' % ('escape_set', 'input', 'engine', 'escape MB/s', 'unescape MB/s'))
+    for set_name, escape_chars in escape_sets:
+        codec = utils.EscapeCodec(escape_chars)
+        for input_name, chunks in inputs:
+            escaped = [codec.escape(chunk) for chunk in chunks]
+            for engine, escape, unescape in [
+                    ('regex', lambda d: regex_escape(d, escape_chars), lambda d: regex_unescape(d, escape_chars)),
+                    ('codec', codec.escape, codec.unescape)]:
+                print('%-12s %-8s %-8s %12.1f %12.1f' % (set_name, input_name, engine, measure(escape, chunks),
+                                                         measure(unescape, escaped)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+# MIT License
+#
+# Copyright (c) 2023 Lonny Wong <lonnywong@qq.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""Compare the memory of the sender file list as dicts and as the slotted file table.
+
+Usage: python -m benchmarks.bench_file_table [file_count] [files_per_dir]
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import tracemalloc
+from .trzsz.libs import utils
+
+
+def dict_entries(path):
+    # the file list before the file table, every entry with its own path list and absolute path
+    file_list = []
+    stack = [(path, [os.path.basename(path)])]
+    while stack:
+        dir_path, rel_path = stack.pop()
+        file_list.append({'path_id': 0, 'abs_path': dir_path, 'path_name': rel_path, 'is_dir': True})
+        for entry in utils.scan_dir(dir_path):
+            if entry.is_dir():
+                stack.append((entry.path, rel_path + [entry.name]))
+            else:
+                file_list.append({
+                    'path_id': 0,
+                    'abs_path': entry.path,
+                    'path_name': rel_path + [entry.name],
+                    'is_dir': False,
+                    'size': os.stat(entry.path).st_size
+                })
+    return file_list
+
+
+def measure(func):
+    tracemalloc.start()
+    result = func()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, size
+
+
+def main():
+    file_count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    files_per_dir = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    root = tempfile.mkdtemp()
+    try:
+        top = os.path.join(root, 'top')
+        os.mkdir(top)
+        for i in range(file_count):
+            if i % files_per_dir == 0:
+                dir_path = os.path.join(top, 'dir%d' % (i // files_per_dir))
+                os.mkdir(dir_path)
+            open(os.path.join(dir_path, 'file%d' % i), 'wb').close()
+
+        files, table_size = measure(lambda: list(utils.walk_paths_readable([top], True)))
+        entries, dict_size = measure(lambda: dict_entries(top))
+        assert len(entries) == len(files)
+        scale = 100000.0 / file_count / 1024 / 1024
+        print('%d files, %d files per directory' % (file_count, files_per_dir))
+        print('dict entries: %8.1f MB per 100k files' % (dict_size * scale))
+        print('file table:   %8.1f MB per 100k files' % (table_size * scale))
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+# MIT License
+#
+# Copyright (c) 2023 Lonny Wong <lonnywong@qq.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Measure how much of the per-chunk time of receiving is spent on hashing.
+
+Usage: python -m benchmarks.bench_hash [size_in_mb] [chunk_size_in_mb]
+"""
+
+import io
+import os
+import sys
+import time
+import threading
+from .trzsz.libs import utils
+from .trzsz.libs import transfer
+
+
+class InlineHasher:
+    """Hash on the transfer thread, as before the HashWorker."""
+
+    def __init__(self, hasher):
+        self.hasher = hasher
+
+    def update(self, data):
+        begin_time = time.time()
+        self.hasher.update(data)
+        utils.GLOBAL.hash_time += time.time() - begin_time
+        utils.GLOBAL.hash_wait_time += time.time() - begin_time
+
+    def digest(self):
+        return self.hasher.digest()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, _exc_type, _exc_value, _traceback):
+        pass
+
+
+def write_frames(write_fd, frame, count):
+    with os.fdopen(write_fd, 'wb') as output:
+        for _ in range(count):
+            output.write(frame)
+
+
+def run(hasher_class, size, chunk_size):
+    count = size // chunk_size
+    chunk = utils.CONFIG.escape_codec.escape(os.urandom(chunk_size))
+    frame = b'#DATA:' + str(len(chunk)).encode('latin1') + b'\n' + chunk
+    read_fd, write_fd = os.pipe()
+    sys.stdin = os.fdopen(read_fd, 'rb')
+    utils.current_session().state = utils.GlobalVariables()
+    utils.GLOBAL.trzsz_writer = io.BytesIO()
+    writer = threading.Thread(target=write_frames, args=(write_fd, frame, count))
+    writer.start()
+    transfer.HashWorker, hash_worker = hasher_class, transfer.HashWorker
+    try:
+        with open(os.devnull, 'wb') as file:
+            begin_time = time.time()
+            transfer.recv_file_data(file, count * chunk_size, None)
+            elapsed = time.time() - begin_time
+    finally:
+        transfer.HashWorker = hash_worker
+        writer.join()
+        sys.stdin.close()
+    return elapsed / count * 1000, utils.GLOBAL.hash_time / count * 1000, utils.GLOBAL.hash_wait_time / count * 1000
+
+
+def main():
+    size = int(float(sys.argv[1]) * 1024 * 1024) if len(sys.argv) > 1 else 512 * 1024 * 1024
+    chunk_size = int(float(sys.argv[2]) * 1024 * 1024) if len(sys.argv) > 2 else 10 * 1024 * 1024
+    utils.CONFIG.loads({'binary': True, 'escape_chars': utils.get_escape_chars(False)})
+    print('%-10s %14s %14s %18s' % ('hashing', 'chunk ms', 'hash ms', 'blocked on hash ms'))
+    for name, hasher_class in (('inline', InlineHasher), ('thread', transfer.HashWorker)):
+        chunk_ms, hash_ms, wait_ms = run(hasher_class, size, chunk_size)
+        print('%-10s %14.2f %14.2f %18.2f' % (name, chunk_ms, hash_ms, wait_ms))
+
+
+if __name__ == '__main__':
+    main()
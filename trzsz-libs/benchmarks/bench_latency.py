@@ -0,0 +1,288 @@
+# MIT License
+#
+# Copyright (c) 2023 Lonny Wong <lonnywong@qq.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""Measure trz / tsz over an emulated slow link: one-way delay, jitter, bandwidth cap, tmux-like byte mangling and
+small pipe buffers, all between a client on trzsz.libs.transfer and trzsz-svr on this box, without any network.
+
+Usage: python -m benchmarks.bench_latency [--json results.jsonl] [--rtt 50 150 300] [--jitter 5] [--bandwidth 10]
+           [--pipe-size 4096] [--mangle none utf8] [--mode base64 binary] [--bufsize 1M] [--files 10M 1Kx100]
+           [--direction upload download]
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import resource
+import tempfile
+import threading
+import subprocess
+from .trzsz.libs import utils
+from .trzsz.libs import transfer
+from .trzsz.libs.__version__ import __version__
+from .bench_loopback import (LIBS_ROOT, MODE_ARGS, cpu_time, drain_output, prepare_files, server_command, server_env,
+                             wait_trigger)
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Linux only, fcntl doesn't export it before Python 3.10
+F_SETPIPE_SZ = getattr(fcntl, 'F_SETPIPE_SZ', 1031)
+
+
+def mangle_utf8(data):
+    # tmux in normal mode reads the input as UTF-8, the bytes above 0x7f arrive encoded as latin1 characters
+    return data.decode('latin1').encode('utf8')
+
+
+MANGLERS = {'none': None, 'utf8': mangle_utf8}
+
+
+def set_pipe_size(fd, size):
+    if size and fcntl:
+        try:
+            fcntl.fcntl(fd, F_SETPIPE_SZ, size)
+        except (IOError, OSError):
+            pass
+
+
+class LinkDirection:
+    """Relays one direction of the link, the chunks arrive in order after the delay and at most at the bandwidth."""
+
+    def __init__(self, src_fd, dst_fd, link):
+        self.src_fd = src_fd
+        self.dst_fd = dst_fd
+        self.link = link
+        self.cond = threading.Condition()
+        self.chunks = []
+        self.eof = False
+        self.link_free_at = 0
+        self.last_deliver_at = 0
+        self.threads = [threading.Thread(target=self.read_loop), threading.Thread(target=self.write_loop)]
+        for thread in self.threads:
+            thread.daemon = True
+            thread.start()
+
+    def deliver_time(self, size):
+        now = time.time()
+        if self.link['bandwidth'] > 0:
+            self.link_free_at = max(now, self.link_free_at) + size / self.link['bandwidth']
+            now = self.link_free_at
+        delay = self.link['delay'] + random.uniform(-self.link['jitter'], self.link['jitter'])
+        # a byte stream never reorders, the jitter only spreads the chunks
+        self.last_deliver_at = max(now + max(delay, 0), self.last_deliver_at)
+        return self.last_deliver_at
+
+    def read_loop(self):
+        while True:
+            try:
+                data = os.read(self.src_fd, self.link['read_size'])
+            except OSError:
+                data = b''
+            with self.cond:
+                if not data:
+                    self.eof = True
+                else:
+                    if self.link['mangle']:
+                        data = self.link['mangle'](data)
+                    self.chunks.append((self.deliver_time(len(data)), data))
+                self.cond.notify()
+            if not data:
+                return
+
+    def write_loop(self):
+        while True:
+            with self.cond:
+                while not self.chunks and not self.eof:
+                    self.cond.wait()
+                if not self.chunks:
+                    os.close(self.dst_fd)
+                    return
+                deliver_at, data = self.chunks.pop(0)
+            time.sleep(max(deliver_at - time.time(), 0))
+            try:
+                while data:
+                    data = data[os.write(self.dst_fd, data):]
+            except OSError:
+                os.close(self.dst_fd)
+                return
+
+    def join(self):
+        for thread in self.threads:
+            thread.join()
+
+
+class LinkEmulator:
+    """Sits between the client and the server process, the client uses stdin and stdout of the emulator."""
+
+    def __init__(self, proc, link):
+        client_read_fd, self.to_client_fd = os.pipe()
+        self.from_client_fd, client_write_fd = os.pipe()
+        for fd in (client_read_fd, self.to_client_fd, self.from_client_fd, client_write_fd):
+            set_pipe_size(fd, link['pipe_size'])
+        self.stdin = os.fdopen(client_read_fd, 'rb', 0)
+        self.stdout = os.fdopen(client_write_fd, 'wb', 0)
+        self.directions = [
+            LinkDirection(self.from_client_fd, os.dup(proc.stdin.fileno()), dict(link)),
+            LinkDirection(proc.stdout.fileno(), self.to_client_fd, dict(link, mangle=None)),
+        ]
+        # the emulator holds its own copy of the server input
+        proc.stdin.close()
+
+    def close(self):
+        self.stdout.close()
+        for direction in self.directions:
+            direction.join()
+        self.stdin.close()
+
+
+def run_case(case):
+    link = {
+        'delay': case['rtt'] / 2000.0,
+        'jitter': case['jitter'] / 1000.0,
+        'bandwidth': case['bandwidth'] * 1024 * 1024 / 8.0,
+        'read_size': case['pipe_size'] or 64 * 1024,
+        'pipe_size': case['pipe_size'],
+        'mangle': MANGLERS[case['mangle']],
+    }
+    root = tempfile.mkdtemp()
+    try:
+        src_path, total_size, directory = prepare_files(os.path.join(root, ''), case['files'], 'random')
+        dest_path = os.path.join(root, 'dest')
+        os.mkdir(dest_path)
+        args = ['-d'] if directory else []
+        args += [dest_path] if case['direction'] == 'upload' else [src_path]
+        cmd = server_command(case) + ['-q', '-t', '0'] + MODE_ARGS[case['mode']] + ['-B', case['bufsize']] + args
+        proc = subprocess.Popen(  # pylint: disable=consider-using-with
+            cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, env=server_env())
+        for pipe in (proc.stdin, proc.stdout):
+            set_pipe_size(pipe.fileno(), case['pipe_size'])
+        emulator = LinkEmulator(proc, link)
+        utils.GLOBAL.stdin = emulator.stdin
+        utils.GLOBAL.trzsz_writer = emulator.stdout
+        wait_trigger(emulator.stdin)
+
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        begin_time = time.time()
+        error = None
+        try:
+            if case['direction'] == 'upload':
+                file_list = utils.check_paths_readable([src_path], directory)
+                transfer.send_action(True, __version__, False, len(file_list))
+                transfer.recv_config()
+                transfer.send_files(file_list)
+            else:
+                transfer.send_action(True, __version__, False)
+                transfer.recv_config()
+                transfer.recv_files(dest_path)
+            transfer.client_exit('Done')
+        except utils.TrzszError as ex:
+            # the mangled bytes break the binary mode, as in tmux
+            error = str(ex).strip().splitlines()[-1]
+            transfer.client_error(ex)
+        elapsed = time.time() - begin_time
+        client_usage = resource.getrusage(resource.RUSAGE_SELF)
+
+        drain_output(emulator.stdin)
+        emulator.close()
+        proc.wait()
+    finally:
+        shutil.rmtree(root)
+
+    result = dict(case)
+    result.update({
+        'bytes': total_size,
+        'seconds': round(elapsed, 3),
+        'mb_per_s': None if error else round(total_size / 1024.0 / 1024 / elapsed, 3),
+        'client_cpu_s': round(cpu_time(client_usage) - cpu_time(usage), 3),
+        'error': error,
+    })
+    return result
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='trz / tsz over an emulated slow link.')
+    parser.add_argument('--json', help='append the results as JSON lines to this file')
+    parser.add_argument('--rtt', nargs='+', type=int, help='round trip times in milliseconds')
+    parser.add_argument('--jitter', nargs='+', type=int, help='the one-way jitter in milliseconds')
+    parser.add_argument('--bandwidth', nargs='+', type=float, help='Mbit/s each way, 0 for no cap')
+    parser.add_argument('--pipe-size', nargs='+', type=int, help='pipe buffer bytes, 0 for the system default')
+    parser.add_argument('--mangle', nargs='+', choices=sorted(MANGLERS))
+    parser.add_argument('--mode', nargs='+', choices=sorted(MODE_ARGS))
+    parser.add_argument('--bufsize', nargs='+')
+    parser.add_argument('--files', nargs='+', help='a file size like 10M, or 1Kx100 for 100 files of 1K')
+    parser.add_argument('--direction', nargs='+', choices=['upload', 'download'])
+    parser.add_argument('--case', help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.case:
+        print(json.dumps(run_case(json.loads(args.case))))
+        return
+
+    matrix = {
+        'rtt': args.rtt or [50, 150, 300],
+        'jitter': args.jitter or [0],
+        'bandwidth': args.bandwidth or [0],
+        'pipe_size': args.pipe_size or [0],
+        'mangle': args.mangle or ['none'],
+        'direction': args.direction or ['upload', 'download'],
+        'files': args.files or ['10M', '1Kx100'],
+        'mode': args.mode or ['base64', 'binary'],
+        'bufsize': args.bufsize or ['10M'],
+    }
+    cases = [{}]
+    for key in ('rtt', 'jitter', 'bandwidth', 'pipe_size', 'mangle', 'direction', 'files', 'mode', 'bufsize'):
+        cases = [dict(case, **{key: value}) for case in cases for value in matrix[key]]
+
+    print('%5s %6s %7s %6s %-6s %-8s %-7s %-6s %-4s %9s %8s %9s' % ('rtt', 'jitter', 'Mbit/s', 'pipe', 'mangle', 'dir',
+                                                                  'files', 'mode', 'buf', 'MB/s', 'seconds', 'cpu'))
+    for case in cases:
+        cmd = [sys.executable, '-m', 'benchmarks.bench_latency', '--case', json.dumps(case)]
+        # the errors of the failed cases are in the results, their tracebacks are only shown if the case crashes
+        proc = subprocess.Popen(cmd, cwd=LIBS_ROOT, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        output, errors = proc.communicate()
+        if proc.returncode != 0:
+            sys.stderr.write(errors.decode('utf8'))
+            raise subprocess.CalledProcessError(proc.returncode, cmd)
+        result = json.loads(output.decode('utf8').strip().splitlines()[-1])
+        speed = 'failed' if result['error'] else '%.3f' % result['mb_per_s']
+        print('%5d %6d %7s %6s %-6s %-8s %-7s %-6s %-4s %9s %8.2f %8.2fs' %
+              (case['rtt'], case['jitter'], case['bandwidth'] or '-', case['pipe_size'] or '-', case['mangle'],
+               case['direction'], case['files'], case['mode'], case['bufsize'], speed, result['seconds'],
+               result['client_cpu_s']))
+        sys.stdout.flush()
+        if args.json:
+            with open(args.json, 'a') as file:
+                file.write(json.dumps(result, sort_keys=True) + '\n')
+
+
+if __name__ == '__main__':
+    main()
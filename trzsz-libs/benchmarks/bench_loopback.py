@@ -0,0 +1,242 @@
+# MIT License
+#
+# Copyright (c) 2023 Lonny Wong <lonnywong@qq.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""Run trz / tsz of trzsz-svr against a client on trzsz.libs.transfer, through a pipe pair or a pty on this box.
+
+Reports MB/s, CPU seconds per GB and peak RSS of both sides for a matrix of modes, buffer sizes, file sets and data
+kinds, and writes one JSON object per case with --json for regression comparison.
+
+Usage: python -m benchmarks.bench_loopback [--full] [--json results.jsonl] [--transport pipe pty]
+           [--mode base64 binary escape] [--bufsize 1M 10M] [--files 1Kx10000 100M] [--data text random]
+           [--direction upload download]
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import argparse
+import resource
+import tempfile
+import subprocess
+from .trzsz.libs import utils
+from .trzsz.libs import transfer
+from .trzsz.libs.__version__ import __version__
+
+LIBS_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SVR_ROOT = os.path.join(os.path.dirname(LIBS_ROOT), 'trzsz-svr')
+
+MODE_ARGS = {'base64': [], 'binary': ['-b'], 'escape': ['-b', '-e']}
+
+TRIGGER_REGEX = re.compile(br'::TRZSZ:TRANSFER:([SRD]):')
+
+
+def parse_size(size):
+    units = {'K': 1024, 'M': 1024 * 1024, 'G': 1024 * 1024 * 1024}
+    return int(size[:-1]) * units[size[-1]] if size[-1] in units else int(size)
+
+
+def write_file(path, size, data):
+    # the text compresses well in base64 mode, the random bytes don't, and they need more escaping in binary mode
+    text = b''.join(b'%06d the quick brown fox jumps over the lazy dog\n' % i for i in range(20000))
+    with open(path, 'wb') as file:
+        while size > 0:
+            chunk = os.urandom(min(size, 1024 * 1024)) if data == 'random' else text[:size]
+            file.write(chunk)
+            size -= len(chunk)
+
+
+def prepare_files(root, files, data):
+    # NxM means N bytes each for M files in a directory, a single file otherwise
+    if 'x' in files:
+        size, count = files.split('x')
+        path = os.path.join(root, 'files')
+        os.mkdir(path)
+        for i in range(int(count)):
+            write_file(os.path.join(path, 'f%d' % i), parse_size(size), data)
+        return path, parse_size(size) * int(count), True
+    path = os.path.join(root, 'file')
+    write_file(path, parse_size(files), data)
+    return path, parse_size(files), False
+
+
+def server_command(case):
+    return [sys.executable, '-m', 'trzsz.svr.' + ('recv' if case['direction'] == 'upload' else 'send')]
+
+
+def server_env():
+    env = dict(os.environ)
+    env.pop('TMUX', None)
+    env['PYTHONPATH'] = os.pathsep.join([p for p in (LIBS_ROOT, SVR_ROOT, env.get('PYTHONPATH')) if p])
+    return env
+
+
+def start_server(case, args):
+    env = server_env()
+    cmd = server_command(case) + ['-q'] + MODE_ARGS[case['mode']] + ['-B', case['bufsize']] + args
+    if case['transport'] == 'pty':
+        import pty  # pylint: disable=import-outside-toplevel
+        import tty  # pylint: disable=import-outside-toplevel
+        master, slave = pty.openpty()
+        # raw before the server starts, or the handshake could be echoed by the line discipline
+        tty.setraw(slave)
+        proc = subprocess.Popen(cmd, stdin=slave, stdout=slave, env=env)  # pylint: disable=consider-using-with
+        os.close(slave)
+        return proc, os.fdopen(master, 'rb', 0), os.fdopen(os.dup(master), 'wb', 0)
+    proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, env=env)  # pylint: disable=R1732
+    return proc, proc.stdout, proc.stdin
+
+
+def wait_trigger(reader):
+    output = b''
+    while not TRIGGER_REGEX.search(output) or not output.endswith(b'\n'):
+        buf = os.read(reader.fileno(), 1024)
+        if not buf:
+            raise utils.TrzszError('Server exited: %s' % output.decode('latin1'), trace=False)
+        output += buf
+
+
+def drain_output(reader):
+    try:
+        while os.read(reader.fileno(), 32 * 1024):
+            pass
+    except OSError:  # EIO of the pty after the server exits
+        pass
+
+
+def cpu_time(usage):
+    return usage.ru_utime + usage.ru_stime
+
+
+def run_case(case):
+    # the CPU time of starting the interpreter and importing the server is taken away
+    with open(os.devnull, 'wb') as devnull:
+        subprocess.check_call(server_command(case) + ['--version'], stdout=devnull, env=server_env())
+    startup_cpu = cpu_time(resource.getrusage(resource.RUSAGE_CHILDREN))
+    root = tempfile.mkdtemp()
+    try:
+        src_path, total_size, directory = prepare_files(os.path.join(root, ''), case['files'], case['data'])
+        dest_path = os.path.join(root, 'dest')
+        os.mkdir(dest_path)
+        server_args = ['-d'] if directory else []
+        server_args += [dest_path] if case['direction'] == 'upload' else [src_path]
+        proc, reader, writer = start_server(case, server_args)
+        utils.GLOBAL.stdin = reader
+        utils.GLOBAL.trzsz_writer = writer
+        wait_trigger(reader)
+
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        begin_time = time.time()
+        if case['direction'] == 'upload':
+            file_list = utils.check_paths_readable([src_path], directory)
+            transfer.send_action(True, __version__, False, len(file_list))
+            transfer.recv_config()
+            transfer.send_files(file_list)
+        else:
+            transfer.send_action(True, __version__, False)
+            transfer.recv_config()
+            transfer.recv_files(dest_path)
+        elapsed = time.time() - begin_time
+        client_usage = resource.getrusage(resource.RUSAGE_SELF)
+        transfer.client_exit('Done')
+
+        drain_output(reader)
+        proc.wait()
+        server_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        if proc.returncode != 0:
+            raise utils.TrzszError('Server exit code %d' % proc.returncode, trace=False)
+    finally:
+        shutil.rmtree(root)
+
+    gigabytes = total_size / 1024.0 / 1024 / 1024
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    rss_unit = 1 if sys.platform == 'darwin' else 1024
+    client_cpu = cpu_time(client_usage) - cpu_time(usage)
+    # the children are the startup run and the server, which starts up the same way, tiny cases are within its noise
+    server_cpu = max(cpu_time(server_usage) - startup_cpu * 2, 0)
+    result = dict(case)
+    result.update({
+        'bytes': total_size,
+        'seconds': round(elapsed, 3),
+        'mb_per_s': round(total_size / 1024.0 / 1024 / elapsed, 1),
+        'client_cpu_s_per_gb': round(client_cpu / gigabytes, 2),
+        'server_cpu_s_per_gb': round(server_cpu / gigabytes, 2),
+        'client_peak_rss_mb': round(client_usage.ru_maxrss * rss_unit / 1024.0 / 1024, 1),
+        'server_peak_rss_mb': round(server_usage.ru_maxrss * rss_unit / 1024.0 / 1024, 1),
+    })
+    return result
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Loopback end-to-end throughput of trz / tsz.')
+    parser.add_argument('--full', action='store_true', help='the full matrix, up to a 4G file and the pty')
+    parser.add_argument('--json', help='append the results as JSON lines to this file')
+    parser.add_argument('--transport', nargs='+', choices=['pipe', 'pty'])
+    parser.add_argument('--mode', nargs='+', choices=sorted(MODE_ARGS))
+    parser.add_argument('--bufsize', nargs='+')
+    parser.add_argument('--files', nargs='+', help='a file size like 100M, or 1Kx10000 for 10000 files of 1K')
+    parser.add_argument('--data', nargs='+', choices=['text', 'random'])
+    parser.add_argument('--direction', nargs='+', choices=['upload', 'download'])
+    parser.add_argument('--case', help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.case:
+        # each case runs in its own process, so that the peak RSS is its own
+        print(json.dumps(run_case(json.loads(args.case))))
+        return
+
+    matrix = {
+        'transport': args.transport or (['pipe', 'pty'] if args.full else ['pipe']),
+        'mode': args.mode or ['base64', 'binary', 'escape'],
+        'bufsize': args.bufsize or ['1M', '10M'],
+        'files': args.files or (['1Kx10000', '1Mx100', '100M', '1G', '4G'] if args.full else ['1Kx10000', '100M']),
+        'data': args.data or ['text', 'random'],
+        'direction': args.direction or ['upload', 'download'],
+    }
+    cases = [{}]
+    for key in ('transport', 'direction', 'files', 'data', 'mode', 'bufsize'):
+        cases = [dict(case, **{key: value}) for case in cases for value in matrix[key]]
+
+    print('%-5s %-8s %-8s %-6s %-6s %-4s %9s %13s %13s %9s %9s' %
+          ('', 'dir', 'files', 'data', 'mode', 'buf', 'MB/s', 'client cpu/G', 'server cpu/G', 'cli RSS', 'svr RSS'))
+    for case in cases:
+        cmd = [sys.executable, '-m', 'benchmarks.bench_loopback', '--case', json.dumps(case)]
+        output = subprocess.check_output(cmd, cwd=LIBS_ROOT)
+        result = json.loads(output.decode('utf8').strip().splitlines()[-1])
+        print('%-5s %-8s %-8s %-6s %-6s %-4s %9.1f %12.2fs %12.2fs %7.1fMB %7.1fMB' %
+              (case['transport'], case['direction'], case['files'], case['data'], case['mode'], case['bufsize'],
+               result['mb_per_s'], result['client_cpu_s_per_gb'], result['server_cpu_s_per_gb'],
+               result['client_peak_rss_mb'], result['server_peak_rss_mb']))
+        sys.stdout.flush()
+        if args.json:
+            with open(args.json, 'a') as file:
+                file.write(json.dumps(result, sort_keys=True) + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+# MIT License
+#
+# Copyright (c) 2023 Lonny Wong <lonnywong@qq.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Compare sending a large file read by read() and through mmap, the throughput and the peak RSS.
+
+Usage: python -m benchmarks.bench_mmap [size_in_mb] [bufsize_in_mb] [binary|base64]
+"""
+
+import os
+import sys
+import time
+import resource
+import tempfile
+import subprocess
+from .trzsz.libs import utils
+from .trzsz.libs import transfer
+
+
+def send(path, bufsize, binary, use_mmap):
+    utils.MMAP_MIN_SIZE = 1 if use_mmap else 0
+    utils.CONFIG.loads({'binary': binary, 'escape_chars': utils.get_escape_chars(False), 'bufsize': bufsize})
+    utils.check_integer = lambda expect: None  # no receiver
+    size = os.path.getsize(path)
+    with open(os.devnull, 'wb') as output, transfer.open_file(path) as file:
+        utils.GLOBAL.trzsz_writer = output
+        base_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        begin_time = time.time()
+        transfer.send_file_data(file, size, None)
+        elapsed = time.time() - begin_time
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    unit = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    print('%-6s %-6s %10.1f MB/s, peak RSS %.1f MB (+%.1f MB while sending)' %
+          ('binary' if binary else 'base64', 'mmap' if use_mmap else 'read', size / 1024.0 / 1024 / elapsed,
+           peak_rss * 1024.0 / unit / 1024, (peak_rss - base_rss) * 1024.0 / unit / 1024))
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == '--child':
+        send(sys.argv[2], int(sys.argv[3]), sys.argv[4] == 'binary', sys.argv[5] == 'mmap')
+        return
+    size = int(float(sys.argv[1]) * 1024 * 1024) if len(sys.argv) > 1 else 256 * 1024 * 1024
+    bufsize = int(float(sys.argv[2]) * 1024 * 1024) if len(sys.argv) > 2 else 10 * 1024 * 1024
+    transfer_mode = sys.argv[3] if len(sys.argv) > 3 else 'binary'
+    fd, path = tempfile.mkstemp()
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            for _ in range(size // (1024 * 1024)):
+                file.write(os.urandom(1024 * 1024))
+        # each mode runs in its own process, so that the peak RSS is its own
+        for mode in ('read', 'mmap'):
+            subprocess.check_call(
+                [sys.executable, '-m', 'benchmarks.bench_mmap', '--child', path, str(bufsize), transfer_mode, mode])
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+# MIT License
+#
+# Copyright (c) 2023 Lonny Wong <lonnywong@qq.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Measure the throughput and the peak RSS of receiving binary DATA chunks.
+
+Usage: python -m benchmarks.bench_recv [size_in_mb] [chunk_size_in_mb]
+"""
+
+import os
+import sys
+import time
+import resource
+import threading
+from .trzsz.libs import utils
+
+
+def write_frames(write_fd, frame, count):
+    with os.fdopen(write_fd, 'wb') as output:
+        for _ in range(count):
+            output.write(frame)
+
+
+def main():
+    size = int(float(sys.argv[1]) * 1024 * 1024) if len(sys.argv) > 1 else 512 * 1024 * 1024
+    chunk_size = int(float(sys.argv[2]) * 1024 * 1024) if len(sys.argv) > 2 else 10 * 1024 * 1024
+    count = size // chunk_size
+    utils.CONFIG.loads({'binary': True, 'escape_chars': utils.get_escape_chars(False)})
+    # the escaped chunk is unchanged by unescaping, like most chunks of compressed files
+    chunk = bytes(bytearray(i % 0x7e for i in range(chunk_size)))
+    frame = b'#DATA:' + str(len(chunk)).encode('latin1') + b'\n' + chunk
+    read_fd, write_fd = os.pipe()
+    sys.stdin = os.fdopen(read_fd, 'rb')
+    writer = threading.Thread(target=write_frames, args=(write_fd, frame, count))
+    base_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    begin_time = time.time()
+    writer.start()
+    total = 0
+    for _ in range(count):
+        total += len(utils.recv_data())
+    elapsed = time.time() - begin_time
+    writer.join()
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    unit = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    print('received %d chunks of %.1f MB: %.1f MB/s, peak RSS %.1f MB (+%.1f MB while receiving)' %
+          (count, chunk_size / 1024.0 / 1024, total / 1024.0 / 1024 / elapsed, peak_rss * 1024.0 / unit / 1024,
+           (peak_rss - base_rss) * 1024.0 / unit / 1024))
+
+
+if __name__ == '__main__':
+    main()
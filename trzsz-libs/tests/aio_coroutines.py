@@ -0,0 +1,81 @@
+# MIT License
+#
+# Copyright (c) 2023 Lonny Wong <lonnywong@qq.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+# The coroutines of test_transfer_aio, which is loaded by Python 2 and can't hold them.
+
+import asyncio
+from .trzsz.libs import aio
+from .trzsz.libs import utils
+
+
+async def open_socket(sock):
+    return await asyncio.open_connection(sock=sock, limit=1024)
+
+
+async def send_files(sock, paths):
+    reader, writer = await open_socket(sock)
+    await aio.send_action(writer, True, '1.0.0', False)
+    await aio.recv_config(reader)
+    remote_list = await aio.send_files(reader, writer, utils.check_paths_readable(paths, True))
+    await aio.recv_exit(reader)
+    writer.close()
+    return remote_list
+
+
+async def recv_files(sock, dest_path, config):
+    reader, writer = await open_socket(sock)
+    action = await aio.recv_json(reader, 'ACT', True)
+    # both ends share the config, as the server does in send_config
+    utils.CONFIG.loads(config)
+    await aio.send_json(writer, 'CFG', config)
+    local_list = await aio.recv_files(reader, writer, dest_path)
+    await aio.client_exit(writer, 'Saved')
+    writer.close()
+    return action, local_list
+
+
+async def send_and_recv_files(sender_sock, receiver_sock, paths, dest_path, config):
+    return await asyncio.gather(send_files(sender_sock, paths), recv_files(receiver_sock, dest_path, config))
+
+
+def transfer_files(sender_sock, receiver_sock, paths, dest_path, config):
+    return asyncio.run(send_and_recv_files(sender_sock, receiver_sock, paths, dest_path, config))
+
+
+async def recv_files_only(sock, dest_path):
+    reader, writer = await open_socket(sock)
+    return await aio.recv_files(reader, writer, dest_path)
+
+
+def recv_from_socket(sock, dest_path):
+    return asyncio.run(recv_files_only(sock, dest_path))
+
+
+async def recv_data_only(buf):
+    reader = asyncio.StreamReader()
+    reader.feed_data(buf)
+    return await aio.recv_data(reader)
+
+
+def recv_data(buf):
+    return asyncio.run(recv_data_only(buf))
@@ -34,12 +34,12 @@ class TestTransferAction(unittest.TestCase):
 
     def tearDown(self):
         utils.IS_RUNNING_ON_WINDOWS = platform.system() == 'Windows'
-        utils.CONFIG = utils.TransferConfig()
-        utils.GLOBAL = utils.GlobalVariables()
+        utils.reset_session()
 
     def test_action_compatible(self):
-        utils.GLOBAL.next_read_buffer = b'#ACT:eJw0ykEKwkAMQNG7/HUojMucRZBaxxIYkyGdKiLe3YV0+3gf' + \
-            b'2uwryhoIz5qbhaOUqUwFYQm/Wz7QkXsVvL6aeUU5O0LPGLFEQ0/C1XzO9zG3vffIcblZ/un7CwAA//8fnSN6\n'
+        utils.GLOBAL.frame_reader.feed(
+            b'#ACT:eJw0ykEKwkAMQNG7/HUojMucRZBaxxIYkyGdKiLe3YV0+3gf' +
+            b'2uwryhoIz5qbhaOUqUwFYQm/Wz7QkXsVvL6aeUU5O0LPGLFEQ0/C1XzO9zG3vffIcblZ/un7CwAA//8fnSN6\n')
         action = transfer.recv_action()
         self.assertEqual(
             {
@@ -64,13 +64,23 @@ class TestTransferAction(unittest.TestCase):
         self.assertEqual('\n', utils.CONFIG.newline)
 
         utils.IS_RUNNING_ON_WINDOWS = False
-        utils.GLOBAL.next_read_buffer = stdout.getvalue().encode('utf8')
+        utils.GLOBAL.frame_reader.feed(stdout.getvalue().encode('utf8'))
         action = transfer.recv_action()
         self.assertEqual('\n', action.get('newline', '\n'))
         self.assertTrue(action.get('binary', True))
         self.assertFalse(utils.GLOBAL.windows_protocol)
         self.assertEqual('\n', utils.CONFIG.newline)
         self.assertEqual(1, action.get('protocol', 0))
+        self.assertNotIn('file_num', action)
+
+    def test_action_file_num(self):
+        stdout = io.StringIO()
+        utils.GLOBAL.trzsz_writer = stdout
+        transfer.send_action(True, '1.0.0', False, 8)
+        utils.GLOBAL.frame_reader.feed(stdout.getvalue().encode('utf8'))
+        action = transfer.recv_action()
+        self.assertTrue(action.get('support_fast_handshake'))
+        self.assertEqual(8, action.get('file_num'))
 
     def test_windows_2_linux(self):
         utils.IS_RUNNING_ON_WINDOWS = True
@@ -82,7 +92,7 @@ class TestTransferAction(unittest.TestCase):
         self.assertEqual('\n', utils.CONFIG.newline)
 
         utils.IS_RUNNING_ON_WINDOWS = False
-        utils.GLOBAL.next_read_buffer = stdout.getvalue().encode('utf8')
+        utils.GLOBAL.frame_reader.feed(stdout.getvalue().encode('utf8'))
         action = transfer.recv_action()
         self.assertEqual('!\n', action.get('newline', '\n'))
         self.assertFalse(action.get('binary', True))
@@ -100,7 +110,7 @@ class TestTransferAction(unittest.TestCase):
         self.assertEqual('!\n', utils.CONFIG.newline)
 
         utils.IS_RUNNING_ON_WINDOWS = True
-        utils.GLOBAL.next_read_buffer = stdout.getvalue().encode('utf8')
+        utils.GLOBAL.frame_reader.feed(stdout.getvalue().encode('utf8'))
         action = transfer.recv_action()
         self.assertEqual('!\n', action.get('newline', '\n'))
         self.assertFalse(action.get('binary', True))
@@ -118,7 +128,7 @@ class TestTransferAction(unittest.TestCase):
         self.assertEqual('!\n', utils.CONFIG.newline)
 
         utils.IS_RUNNING_ON_WINDOWS = True
-        utils.GLOBAL.next_read_buffer = stdout.getvalue().encode('utf8')
+        utils.GLOBAL.frame_reader.feed(stdout.getvalue().encode('utf8'))
         action = transfer.recv_action()
         self.assertEqual('!\n', action.get('newline', '\n'))
         self.assertFalse(action.get('binary', True))
@@ -0,0 +1,118 @@
+# MIT License
+#
+# Copyright (c) 2023 Lonny Wong <lonnywong@qq.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import os
+import sys
+import shutil
+import socket
+import tempfile
+import threading
+import unittest
+from .trzsz.libs import utils
+from .trzsz.libs import transfer
+
+# asyncio.run requires Python 3.7+, and Python 2 can't parse the coroutines
+if sys.version_info >= (3, 7):
+    from . import aio_coroutines
+
+
+@unittest.skipIf(sys.version_info < (3, 7), 'asyncio.run requires Python 3.7+')
+class TestTransferAio(unittest.TestCase):
+
+    def setUp(self):
+        self.src_path = tempfile.mkdtemp()
+        self.dst_path = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.src_path, 'd'))
+        self.files = {'a': os.urandom(100 * 1024), 'b': b'', os.path.join('d', 'c'): os.urandom(3000)}
+        for name, data in self.files.items():
+            with open(os.path.join(self.src_path, name), 'wb') as file:
+                file.write(data)
+        self.paths = [os.path.join(self.src_path, name) for name in ('a', 'b', 'd')]
+
+    def tearDown(self):
+        shutil.rmtree(self.src_path)
+        shutil.rmtree(self.dst_path)
+        utils.reset_session()
+
+    def assert_received(self):
+        for name, data in self.files.items():
+            with open(os.path.join(self.dst_path, name), 'rb') as file:
+                self.assertEqual(data, file.read())
+
+    def transfer_files(self, config):
+        sender_sock, receiver_sock = socket.socketpair()
+        remote_list, (action, local_list) = aio_coroutines.transfer_files(sender_sock, receiver_sock, self.paths,
+                                                                          self.dst_path, config)
+        self.assertTrue(action['support_window'])
+        self.assertNotIn('support_pipeline', action)
+        return [remote_list, local_list]
+
+    def test_stop_and_wait(self):
+        config = {'directory': True, 'bufsize': 8 * 1024}
+        self.assertEqual([['a', 'b', 'd'], ['a', 'b', 'd']], self.transfer_files(config))
+        self.assert_received()
+
+    def test_window_binary(self):
+        config = {
+            'directory': True,
+            'binary': True,
+            'escape_chars': utils.get_escape_chars(True),
+            'window_size': 16 * 1024,
+            'window_chunks': 4,
+            'digest': 'sha256',
+            'file_num': 4
+        }
+        self.assertEqual([['a', 'b', 'd'], ['a', 'b', 'd']], self.transfer_files(config))
+        self.assert_received()
+
+    def test_recv_from_blocking_sender(self):
+        utils.CONFIG.loads({'directory': True, 'binary': True, 'window_size': 16 * 1024, 'window_chunks': 4})
+        sender_sock, receiver_sock = socket.socketpair()
+        stdin = sys.stdin
+        sys.stdin = sender_sock.makefile('rb')
+        utils.GLOBAL.trzsz_writer = sender_sock.makefile('wb')
+        result = []
+        thread = threading.Thread(
+            target=lambda: result.append(transfer.send_files(utils.check_paths_readable(self.paths, True))))
+        try:
+            thread.start()
+
+            self.assertEqual(['a', 'b', 'd'], aio_coroutines.recv_from_socket(receiver_sock, self.dst_path))
+            thread.join()
+        finally:
+            sys.stdin.close()
+            sys.stdin = stdin
+            utils.GLOBAL.trzsz_writer.close()
+            sender_sock.close()
+        self.assertEqual([['a', 'b', 'd']], result)
+        self.assert_received()
+
+    def test_recv_timeout(self):
+        utils.CONFIG.loads({'timeout': 0.1})
+        with self.assertRaises(utils.TrzszError) as ctx:
+            aio_coroutines.recv_data(b'#DATA:')
+        self.assertIn('Receive data timeout', str(ctx.exception))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -38,6 +38,10 @@ class TestArgs():
         self.directory = True
         self.bufsize = 1024
         self.timeout = 10
+        self.digest = 'md5'
+        self.resume = False
+        self.sync = False
+        self.delta = False
 
 
 class TestTransferConfig(unittest.TestCase):
@@ -50,8 +54,7 @@ class TestTransferConfig(unittest.TestCase):
     def tearDown(self):
         utils.IS_RUNNING_ON_WINDOWS = platform.system() == 'Windows'
         utils.PROTOCOL_VERSION = self.protocol_version
-        utils.CONFIG = utils.TransferConfig()
-        utils.GLOBAL = utils.GlobalVariables()
+        utils.reset_session()
 
     def test_transfer_config(self):
         stdout = io.StringIO()
@@ -76,13 +79,24 @@ class TestTransferConfig(unittest.TestCase):
             'protocol': 2,
             'max_buf_size': 1024,
             'escape_chars': escape_chars,
+            'escape_codec': utils.EscapeCodec(escape_chars),
             'tmux_pane_width': 88,
             'tmux_output_junk': True,
+            'window_size': 0,
+            'window_chunks': 0,
+            'pipeline_size': 0,
+            'file_num': -1,
+            'digest': 'md5',
+            'resume': False,
+            'sync': False,
+            'delta': False,
+            'sparse': False,
+            'file_batches': False,
         }
         self.assertEqual(config, utils.CONFIG.__dict__)
 
         def assert_config_equal(cfg_str):
-            utils.GLOBAL.next_read_buffer = cfg_str.encode('utf8')
+            utils.GLOBAL.frame_reader.feed(cfg_str.encode('utf8'))
             self.assertEqual(config, transfer.recv_config().__dict__)
             self.assertEqual(config, utils.CONFIG.__dict__)
         cfg_str = '#CFG:eJxN0ctOwzAQBdBfibzuwgldhO54teXRLwhR5CQDdR+xccaUtoJvZ0KDZna+R1f2yHNWO9O9q1mi/FFNElXbzoQj' + \
@@ -92,6 +106,80 @@ class TestTransferConfig(unittest.TestCase):
         assert_config_equal(cfg_str)
         assert_config_equal(stdout.getvalue())
 
+    def test_window_config(self):
+        stdout = io.StringIO()
+        utils.GLOBAL.trzsz_writer = stdout
+        transfer.send_config(TestArgs(), {'protocol': 1, 'support_window': True}, [])
+        self.assertEqual(utils.WINDOW_SIZE, utils.CONFIG.window_size)
+        self.assertEqual(utils.WINDOW_CHUNKS, utils.CONFIG.window_chunks)
+        self.assertEqual(0, utils.CONFIG.pipeline_size)
+
+        utils.current_session().config = utils.TransferConfig()
+        utils.GLOBAL.frame_reader.feed(stdout.getvalue().encode('utf8'))
+        config = transfer.recv_config()
+        self.assertEqual(utils.WINDOW_SIZE, config.window_size)
+        self.assertEqual(utils.WINDOW_CHUNKS, config.window_chunks)
+
+    def test_pipeline_config(self):
+        stdout = io.StringIO()
+        utils.GLOBAL.trzsz_writer = stdout
+        transfer.send_config(TestArgs(), {'protocol': 1, 'support_pipeline': True}, [])
+        self.assertEqual(1024, utils.CONFIG.pipeline_size)
+        self.assertEqual(0, utils.CONFIG.window_size)
+
+    def test_fast_handshake_config(self):
+        utils.GLOBAL.trzsz_writer = io.StringIO()
+        transfer.send_config(TestArgs(), {'protocol': 1}, [], 3)
+        self.assertEqual(-1, utils.CONFIG.file_num)
+        transfer.send_config(TestArgs(), {'protocol': 1, 'support_fast_handshake': True}, [], 3)
+        self.assertEqual(3, utils.CONFIG.file_num)
+
+        utils.current_session().config = utils.TransferConfig()
+        transfer.send_config(TestArgs(), {'protocol': 1, 'support_fast_handshake': True}, [])
+        self.assertEqual(-1, utils.CONFIG.file_num)
+        stdout = io.StringIO()
+        utils.GLOBAL.trzsz_writer = stdout
+        transfer.send_config(TestArgs(), {'protocol': 1, 'support_fast_handshake': True, 'file_num': 5}, [])
+        self.assertEqual(5, utils.CONFIG.file_num)
+
+        utils.current_session().config = utils.TransferConfig()
+        utils.GLOBAL.frame_reader.feed(stdout.getvalue().encode('utf8'))
+        self.assertEqual(5, transfer.recv_config().file_num)
+        with self.assertRaises(utils.TrzszError):
+            transfer.send_files([])
+
+    def test_digest_config(self):
+        stdout = io.StringIO()
+        utils.GLOBAL.trzsz_writer = stdout
+        args = TestArgs()
+        args.digest = 'crc32'
+        with self.assertRaises(utils.TrzszError):
+            transfer.send_config(args, {'protocol': 1}, [])
+        transfer.send_config(args, {'protocol': 1, 'support_digests': ['crc32', 'md5']}, [])
+        self.assertEqual('crc32', utils.CONFIG.digest)
+
+        utils.current_session().config = utils.TransferConfig()
+        utils.GLOBAL.frame_reader.feed(stdout.getvalue().encode('utf8'))
+        self.assertEqual('crc32', transfer.recv_config().digest)
+        hasher = utils.new_hasher()
+        hasher.update(b'abc')
+        hasher.update(b'def')
+        self.assertEqual(b'\x4b\x8e\x39\xef', hasher.digest())
+        self.assertEqual(b'', utils.new_hasher('none').digest())
+        with self.assertRaises(utils.TrzszError):
+            utils.new_hasher('md4')
+
+    def test_file_batches_config(self):
+        utils.GLOBAL.trzsz_writer = io.StringIO()
+        action = {'protocol': 1, 'support_file_batches': True, 'support_fast_handshake': True}
+        transfer.send_config(TestArgs(), action, [], 5)
+        self.assertFalse(utils.CONFIG.file_batches)
+        self.assertEqual(5, utils.CONFIG.file_num)
+        utils.current_session().config = utils.TransferConfig()
+        transfer.send_config(TestArgs(), action, [], None)
+        self.assertTrue(utils.CONFIG.file_batches)
+        self.assertEqual(-1, utils.CONFIG.file_num)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,563 @@
+# MIT License
+#
+# Copyright (c) 2023 Lonny Wong <lonnywong@qq.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import io
+import os
+import sys
+import errno
+import shutil
+import hashlib
+import platform
+import tempfile
+import unittest
+from .trzsz.libs import utils
+from .trzsz.libs import transfer
+
+
+class TestWriter(io.BytesIO):
+
+    def write(self, buf):
+        return io.BytesIO.write(self, buf if isinstance(buf, bytes) else buf.encode('utf8'))
+
+
+class TestCallback(utils.TrzszCallback):
+
+    def __init__(self):
+        self.steps = []
+
+    def on_step(self, step):
+        self.steps.append(step)
+
+
+class TestTransferData(unittest.TestCase):
+
+    def setUp(self):
+        utils.IS_RUNNING_ON_WINDOWS = False  # test as on Linux
+        self.data = bytes(bytearray(i % 251 for i in range(7 * 1024)))
+
+    def tearDown(self):
+        utils.IS_RUNNING_ON_WINDOWS = platform.system() == 'Windows'
+        utils.reset_session()
+
+    def encode_chunks(self, chunks):
+        stdout = TestWriter()
+        utils.GLOBAL.trzsz_writer = stdout
+        for chunk in chunks:
+            utils.send_data(chunk)
+        return stdout.getvalue()
+
+    def test_hash_worker(self):
+        with transfer.HashWorker(hashlib.md5()) as md5:
+            for i in range(0, len(self.data), 1000):
+                md5.update(self.data[i:i + 1000])
+            self.assertEqual(hashlib.md5(self.data).digest(), md5.digest())
+        self.assertIsNone(md5.thread)
+
+    def test_read_ahead(self):
+        src_path = tempfile.mkdtemp()
+        try:
+            for name, data in (('a', self.data), ('b', self.data[:100])):
+                with open(os.path.join(src_path, name), 'wb') as file:
+                    file.write(data)
+            file_list = [utils.FileEntry(0, src_path, utils.PathNode(None, name), False) for name in 'abc']
+            with transfer.ReadAhead(file_list, 2) as read_ahead:
+                with read_ahead.open(file_list[0]) as file:
+                    self.assertEqual(self.data[:1024], file.read(1024))
+                    chunks = [file.read(4096) for _ in range(3)]
+                    self.assertEqual(self.data[1024:], b''.join(chunks))
+                    self.assertEqual(b'', file.read(4096))
+                with read_ahead.open(file_list[1]) as file:
+                    self.assertEqual(self.data[:100], file.read(4096))
+                with read_ahead.open(file_list[2]) as file:
+                    with self.assertRaises(IOError):
+                        file.read(4096)
+            self.assertIsNone(read_ahead.thread)
+        finally:
+            shutil.rmtree(src_path)
+
+    def test_mapped_file(self):
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        mmap_min_size = utils.MMAP_MIN_SIZE
+        try:
+            with open(path, 'wb') as file:
+                file.write(self.data)
+            utils.MMAP_MIN_SIZE = len(self.data) + 1
+            with transfer.open_file(path) as file:
+                self.assertNotIsInstance(file, transfer.MappedFile)
+            utils.MMAP_MIN_SIZE = len(self.data)
+            with transfer.open_file(path) as file:
+                # memoryview of mmap requires Python 3, the file is read as usual on Python 2
+                if sys.version_info < (3, ):
+                    self.assertNotIsInstance(file, transfer.MappedFile)
+                else:
+                    self.assertIsInstance(file, transfer.MappedFile)
+                utils.CONFIG.window_size = 16 * 1024
+                stdout = TestWriter()
+                utils.GLOBAL.trzsz_writer = stdout
+                utils.GLOBAL.frame_reader.feed(b'#SUCC:1024\n#SUCC:3072\n#SUCC:7168\n')
+                digest = transfer.send_file_data(file, len(self.data), None)
+                self.assertEqual(hashlib.md5(self.data).digest(), digest)
+                self.assertEqual(self.encode_chunks([self.data[:1024], self.data[1024:3072], self.data[3072:]]),
+                                 stdout.getvalue())
+                file.seek(1000)
+                self.assertEqual(self.data[1000:1010], file.read(10))
+        finally:
+            utils.MMAP_MIN_SIZE = mmap_min_size
+            os.remove(path)
+
+    @unittest.skipIf(not hasattr(os, 'posix_fallocate'), 'requires posix_fallocate')
+    def test_preallocate_file(self):
+        dst_path = tempfile.mkdtemp()
+        preallocate_min_size, mmap_min_size = utils.PREALLOCATE_MIN_SIZE, utils.MMAP_MIN_SIZE
+        try:
+            utils.PREALLOCATE_MIN_SIZE = 1024
+            utils.CONFIG.window_size = 16 * 1024
+            utils.GLOBAL.trzsz_writer = TestWriter()
+            for mmap_size in (0, 1024):
+                utils.MMAP_MIN_SIZE = mmap_size
+                path = os.path.join(dst_path, 'a%d' % mmap_size)
+                utils.GLOBAL.frame_reader.feed(self.encode_chunks([self.data[:1024], self.data[1024:]]))
+                with transfer.do_create_file(path) as file:
+                    self.assertTrue(transfer.preallocate_file(file, 0, len(self.data)))
+                    self.assertEqual(len(self.data), os.path.getsize(path))
+                    digest = transfer.recv_preallocated_file_data(file, len(self.data), None, None, 0, None)
+                self.assertEqual(hashlib.md5(self.data).digest(), digest)
+                with open(path, 'rb') as file:
+                    self.assertEqual(self.data, file.read())
+
+                # the allocated space is truncated when the transfer fails
+                utils.GLOBAL.frame_reader.feed(self.encode_chunks([self.data[:1024]]) + b'#fail:eA==\n')
+                with transfer.do_create_file(path) as file:
+                    self.assertTrue(transfer.preallocate_file(file, 0, len(self.data)))
+                    with self.assertRaises(utils.TrzszError):
+                        transfer.recv_preallocated_file_data(file, len(self.data), None, None, 0, None)
+                self.assertEqual(1024, os.path.getsize(path))
+
+            def no_space(_fd, _offset, _size):
+                raise OSError(errno.ENOSPC, 'No space left on device')
+
+            posix_fallocate = os.posix_fallocate
+            os.posix_fallocate = no_space
+            try:
+                with transfer.do_create_file(os.path.join(dst_path, 'b')) as file:
+                    with self.assertRaises(utils.TrzszError) as context:
+                        transfer.preallocate_file(file, 0, len(self.data))
+                    self.assertIn('No space left on device', context.exception.msg)
+            finally:
+                os.posix_fallocate = posix_fallocate
+        finally:
+            utils.PREALLOCATE_MIN_SIZE, utils.MMAP_MIN_SIZE = preallocate_min_size, mmap_min_size
+            shutil.rmtree(dst_path)
+
+    def test_write_behind(self):
+        file = io.BytesIO()
+        with transfer.WriteBehind(file, 2) as writer:
+            for i in range(0, len(self.data), 1000):
+                writer.write(self.data[i:i + 1000])
+        self.assertEqual(self.data, file.getvalue())
+
+        file.close()
+        writer = transfer.WriteBehind(file, 2)
+        writer.write(self.data)
+        with self.assertRaises(ValueError):
+            writer.close()
+
+    def test_send_window_acks(self):
+        utils.CONFIG.window_size = 4096
+        utils.CONFIG.window_chunks = 2
+        callback = TestCallback()
+        window = transfer.SendWindow(callback)
+        window.in_flight.extend([1024, 3072, 7168])
+        self.assertTrue(window.is_full(7168))
+        utils.GLOBAL.frame_reader.feed(b'#SUCC:3072\n#SUCC:7168\n')
+        window.wait_all()
+        self.assertEqual(7168, window.acked)
+        self.assertEqual([3072, 7168], callback.steps)
+
+        window.in_flight.append(8192)
+        utils.GLOBAL.frame_reader.feed(b'#SUCC:8000\n')
+        with self.assertRaises(utils.TrzszError):
+            window.wait_all()
+
+    def test_send_file_data_window(self):
+        utils.CONFIG.window_size = 16 * 1024
+        utils.CONFIG.window_chunks = 4
+        stdout = TestWriter()
+        utils.GLOBAL.trzsz_writer = stdout
+        utils.GLOBAL.frame_reader.feed(b'#SUCC:1024\n#SUCC:3072\n#SUCC:7168\n')
+        callback = TestCallback()
+        digest = transfer.send_file_data(io.BytesIO(self.data), len(self.data), callback)
+        self.assertEqual(hashlib.md5(self.data).digest(), digest)
+        self.assertEqual([0, 1024, 3072, 7168], callback.steps)
+        self.assertEqual(self.encode_chunks([self.data[:1024], self.data[1024:3072], self.data[3072:]]),
+                         stdout.getvalue())
+
+    def test_recv_file_data_window(self):
+        utils.GLOBAL.frame_reader.feed(self.encode_chunks([self.data[:1024], self.data[1024:]]))
+        utils.CONFIG.window_size = 16 * 1024
+        stdout = TestWriter()
+        utils.GLOBAL.trzsz_writer = stdout
+        file = io.BytesIO()
+        digest = transfer.recv_file_data(file, len(self.data), None)
+        self.assertEqual(hashlib.md5(self.data).digest(), digest)
+        self.assertEqual(self.data, file.getvalue())
+        self.assertEqual(b'#SUCC:1024\n#SUCC:7168\n', stdout.getvalue())
+
+    def test_small_file_data_steps(self):
+        utils.CONFIG.pipeline_size = 1024 * 1024
+        utils.GLOBAL.trzsz_writer = TestWriter()
+        callback = TestCallback()
+        transfer.send_file_data(io.BytesIO(self.data), len(self.data), callback)
+        self.assertEqual([0, len(self.data)], callback.steps)
+
+        utils.GLOBAL.frame_reader.feed(utils.GLOBAL.trzsz_writer.getvalue())
+        callback = TestCallback()
+        transfer.recv_file_data(io.BytesIO(), len(self.data), callback)
+        self.assertEqual([0, len(self.data)], callback.steps)
+
+        utils.GLOBAL.trzsz_writer = TestWriter()
+        with self.assertRaises(utils.TrzszError) as ctx:
+            transfer.send_file_data(io.BytesIO(self.data[:100]), len(self.data), None)
+        self.assertIn('File size changed while sending', str(ctx.exception))
+        self.assertEqual(b'', utils.GLOBAL.trzsz_writer.getvalue())
+
+    def test_resume_file_data(self):
+        dst_path = tempfile.mkdtemp()
+        try:
+            utils.CONFIG.resume = True
+            path = os.path.join(dst_path, 'a')
+            with open(path, 'wb') as file:
+                file.write(self.data[:3072])
+            transfer.save_journal(path, len(self.data))
+            self.assertEqual('a', transfer.get_new_name(dst_path, 'a'))
+
+            stdout = TestWriter()
+            utils.GLOBAL.trzsz_writer = stdout
+            utils.GLOBAL.frame_reader.feed(b'#OFST:3072\n')
+            with transfer.do_create_file(path) as file:
+                offset, hasher = transfer.recv_file_offset(file, len(self.data))
+            self.assertEqual(3072, offset)
+            self.assertEqual(hashlib.md5(self.data[:3072]).digest(), hasher.digest())
+            self.assertEqual(3072, os.path.getsize(path))
+
+            utils.GLOBAL.frame_reader.feed(stdout.getvalue())
+            stdout = TestWriter()
+            utils.GLOBAL.trzsz_writer = stdout
+            file = io.BytesIO(self.data)
+            offset, hasher = transfer.send_file_offset(file, len(self.data))
+            self.assertEqual(3072, offset)
+            self.assertEqual(b'#OFST:3072\n', stdout.getvalue())
+            utils.CONFIG.window_size = 16 * 1024
+            utils.GLOBAL.frame_reader.feed(b'#SUCC:4096\n#SUCC:6144\n#SUCC:7168\n')
+            digest = transfer.send_file_data(file, len(self.data), None, offset=offset, hasher=hasher)
+            self.assertEqual(hashlib.md5(self.data).digest(), digest)
+            self.assertEqual(self.encode_chunks([self.data[3072:4096], self.data[4096:6144], self.data[6144:]]),
+                             stdout.getvalue()[len(b'#OFST:3072\n'):])
+
+            utils.GLOBAL.trzsz_writer = TestWriter()
+            utils.send_json('OFST', {'offset': 1024, 'digest': '00'})
+            utils.GLOBAL.frame_reader.feed(utils.GLOBAL.trzsz_writer.getvalue())
+            utils.GLOBAL.trzsz_writer = TestWriter()
+            self.assertEqual((0, None), transfer.send_file_offset(io.BytesIO(self.data), len(self.data)))
+            self.assertEqual(b'#OFST:0\n', utils.GLOBAL.trzsz_writer.getvalue())
+
+            transfer.remove_journal(path)
+            self.assertEqual('a.0', transfer.get_new_name(dst_path, 'a'))
+        finally:
+            shutil.rmtree(dst_path)
+
+    def test_pipelined_files(self):
+        src_path = tempfile.mkdtemp()
+        dst_path = tempfile.mkdtemp()
+        try:
+            for name, data in (('a', self.data), ('b', b'')):
+                with open(os.path.join(src_path, name), 'wb') as file:
+                    file.write(data)
+            file_list = utils.check_paths_readable([os.path.join(src_path, 'a'), os.path.join(src_path, 'b')], False)
+            utils.CONFIG.pipeline_size = 1024 * 1024
+
+            stdout = TestWriter()
+            utils.GLOBAL.trzsz_writer = stdout
+            utils.send_integer('SUCC', 2)
+            utils.send_json('SUCC', ['a'])
+            utils.send_json('SUCC', ['b'])
+            utils.GLOBAL.frame_reader.feed(stdout.getvalue())
+            stdout = TestWriter()
+            utils.GLOBAL.trzsz_writer = stdout
+            self.assertEqual(['a', 'b'], transfer.send_files(file_list))
+
+            utils.GLOBAL.frame_reader.feed(stdout.getvalue())
+            stdout = TestWriter()
+            utils.GLOBAL.trzsz_writer = stdout
+            self.assertEqual(['a', 'b'], transfer.recv_files(dst_path))
+            with open(os.path.join(dst_path, 'a'), 'rb') as file:
+                self.assertEqual(self.data, file.read())
+            self.assertEqual(0, os.path.getsize(os.path.join(dst_path, 'b')))
+
+            expected = TestWriter()
+            utils.GLOBAL.trzsz_writer = expected
+            utils.send_integer('SUCC', 2)
+            utils.send_json('SUCC', ['a', 'b'])
+            self.assertEqual(expected.getvalue(), stdout.getvalue())
+        finally:
+            shutil.rmtree(src_path)
+            shutil.rmtree(dst_path)
+
+    def test_sync_files(self):
+        src_path = tempfile.mkdtemp()
+        dst_path = tempfile.mkdtemp()
+        try:
+            for path, name, data in ((src_path, 'a', self.data), (src_path, 'b', self.data), (dst_path, 'a', self.data),
+                                     (dst_path, 'b', self.data[1:])):
+                with open(os.path.join(path, name), 'wb') as file:
+                    file.write(data)
+                os.utime(os.path.join(path, name), (1600000000, 1600000000))
+            file_list = utils.check_paths_readable([os.path.join(src_path, 'a'), os.path.join(src_path, 'b')], False)
+            utils.CONFIG.pipeline_size = 1024 * 1024
+            utils.CONFIG.sync = True
+            utils.CONFIG.overwrite = True
+
+            expected = TestWriter()
+            utils.GLOBAL.trzsz_writer = expected
+            utils.send_json('MNFT', [1])
+            utils.send_integer('SUCC', 1)
+            utils.send_json('SUCC', ['b'])
+            utils.GLOBAL.frame_reader.feed(expected.getvalue())
+            stdout = TestWriter()
+            utils.GLOBAL.trzsz_writer = stdout
+            self.assertEqual(['b'], transfer.send_files(file_list))
+
+            utils.GLOBAL.frame_reader.feed(stdout.getvalue())
+            stdout = TestWriter()
+            utils.GLOBAL.trzsz_writer = stdout
+            self.assertEqual(['b'], transfer.recv_files(dst_path))
+            self.assertEqual(expected.getvalue(), stdout.getvalue())
+            with open(os.path.join(dst_path, 'b'), 'rb') as file:
+                self.assertEqual(self.data, file.read())
+            self.assertEqual(1600000000, int(os.path.getmtime(os.path.join(dst_path, 'b'))))
+        finally:
+            shutil.rmtree(src_path)
+            shutil.rmtree(dst_path)
+
+    def test_delta_file_data(self):
+        basis = bytes(bytearray((i * 7 + i // 251) % 256 for i in range(64 * 1024)))
+        # a changed, an inserted, a removed and an appended range
+        data = basis[:5000] + b'changed' + basis[5007:20000] + b'inserted' + basis[20000:40000] + basis[41000:] + b'end'
+        utils.CONFIG.delta = True
+        dst_path = tempfile.mkdtemp()
+        try:
+            path = os.path.join(dst_path, 'a')
+            with open(path, 'wb') as file:
+                file.write(basis)
+            stdout = TestWriter()
+            utils.GLOBAL.trzsz_writer = stdout
+            with transfer.do_create_file(path) as file:
+                self.assertEqual((2048, 32), transfer.send_file_signatures(file))
+
+            utils.GLOBAL.frame_reader.feed(stdout.getvalue() + ('#SUCC:%d\n' % len(data)).encode('latin1'))
+            stdout = TestWriter()
+            utils.GLOBAL.trzsz_writer = stdout
+            callback = TestCallback()
+            digest = transfer.send_file_delta(io.BytesIO(data), len(data), callback)
+            self.assertEqual(hashlib.md5(data).digest(), digest)
+            self.assertEqual([0, len(data)], callback.steps)
+            self.assertLess(len(stdout.getvalue()), len(data) // 4)
+
+            utils.GLOBAL.frame_reader.feed(stdout.getvalue())
+            utils.GLOBAL.trzsz_writer = TestWriter()
+            delta_file = io.BytesIO()
+            with transfer.do_create_file(path) as file:
+                self.assertEqual(digest, transfer.recv_file_delta(file, len(data), None, delta_file))
+            self.assertEqual(data, delta_file.getvalue())
+        finally:
+            shutil.rmtree(dst_path)
+
+    def write_sparse_file(self, path, size):
+        with open(path, 'wb') as file:
+            file.truncate(size)
+            file.seek(2 * 1024 * 1024)
+            file.write(self.data)
+            file.seek(size - 100)
+            file.write(self.data[:100])
+        with open(path, 'rb') as file:
+            return transfer.get_file_holes(file.fileno(), size), file.read()
+
+    def send_and_recv_files(self, file_list, names, dst_path):
+        stdout = TestWriter()
+        utils.GLOBAL.trzsz_writer = stdout
+        utils.send_integer('SUCC', len(names))
+        for name in names:
+            utils.send_json('SUCC', [name])
+        utils.GLOBAL.frame_reader.feed(stdout.getvalue())
+        stdout = TestWriter()
+        utils.GLOBAL.trzsz_writer = stdout
+        callback = TestCallback()
+        self.assertEqual(names, transfer.send_files(file_list, callback))
+        utils.GLOBAL.frame_reader.feed(stdout.getvalue())
+        utils.GLOBAL.trzsz_writer = TestWriter()
+        self.assertEqual(names, transfer.recv_files(dst_path))
+        return callback, stdout
+
+    @unittest.skipIf(not hasattr(os, 'SEEK_DATA'), 'SEEK_DATA requires Python 3.3+')
+    def test_sparse_files(self):
+        src_path = tempfile.mkdtemp()
+        dst_path = tempfile.mkdtemp()
+        try:
+            size = 8 * 1024 * 1024
+            holes, expected_data = self.write_sparse_file(os.path.join(src_path, 'a'), size)
+            file_list = utils.check_paths_readable([os.path.join(src_path, 'a')], False)
+            utils.CONFIG.pipeline_size = 1024 * 1024
+            utils.CONFIG.sparse = True
+
+            callback, stdout = self.send_and_recv_files(file_list, ['a'], dst_path)
+            self.assertEqual(size, callback.steps[-1])
+            if holes:
+                self.assertLess(len(stdout.getvalue()), 1024 * 1024)
+            with open(os.path.join(dst_path, 'a'), 'rb') as file:
+                self.assertEqual(expected_data, file.read())
+            if holes:
+                self.assertLess(os.stat(os.path.join(dst_path, 'a')).st_blocks * 512, size // 2)
+        finally:
+            shutil.rmtree(src_path)
+            shutil.rmtree(dst_path)
+
+    @unittest.skipIf(not hasattr(os, 'SEEK_DATA'), 'SEEK_DATA requires Python 3.3+')
+    def test_sparse_file_read_ahead(self):
+        src_path = tempfile.mkdtemp()
+        dst_path = tempfile.mkdtemp()
+        try:
+            size = 8 * 1024 * 1024
+            _, expected_data = self.write_sparse_file(os.path.join(src_path, 'a'), size)
+            with open(os.path.join(src_path, 'b'), 'wb') as file:
+                file.write(self.data)
+            paths = [os.path.join(src_path, name) for name in 'ab']
+            file_list = utils.check_paths_readable(paths, False)
+            utils.CONFIG.pipeline_size = 1024 * 1024
+            utils.CONFIG.sparse = True
+            self.assertGreater(utils.READ_AHEAD_CHUNKS, 0)
+
+            # the file after the sparse file reads its own read-ahead slot
+            self.send_and_recv_files(file_list, ['a', 'b'], dst_path)
+            with open(os.path.join(dst_path, 'a'), 'rb') as file:
+                self.assertEqual(expected_data, file.read())
+            with open(os.path.join(dst_path, 'b'), 'rb') as file:
+                self.assertEqual(self.data, file.read())
+        finally:
+            shutil.rmtree(src_path)
+            shutil.rmtree(dst_path)
+
+    def test_sparse_file_offsets(self):
+        file = io.BytesIO()
+        sparse_file = transfer.SparseFile(file, [[0, 10], [15, 5], [25, 5]])
+        sparse_file.write(b'abcde' + b'fghij')
+        self.assertEqual(b'\0' * 10 + b'abcde' + b'\0' * 5 + b'fghij', file.getvalue())
+        self.assertEqual([10, 12, 20, 24, 30], [sparse_file.file_offset(step) for step in (0, 2, 5, 9, 10)])
+        file.seek(0)
+        sparse_file = transfer.SparseFile(file, [[0, 10], [15, 5], [25, 5]])
+        self.assertEqual(b'abcdefgh', sparse_file.read(8))
+        self.assertEqual(b'ij', sparse_file.read(8))
+
+    def test_file_batches(self):
+        src_path = tempfile.mkdtemp()
+        dst_path = tempfile.mkdtemp()
+        file_batch_size = utils.FILE_BATCH_SIZE
+        try:
+            os.mkdir(os.path.join(src_path, 'd'))
+            for name in ('a', 'b', 'c'):
+                with open(os.path.join(src_path, 'd', name), 'wb') as file:
+                    file.write(name.encode('latin1') * 100)
+            utils.FILE_BATCH_SIZE = 2
+            utils.CONFIG.pipeline_size = 1024 * 1024
+            utils.CONFIG.directory = True
+            utils.CONFIG.file_batches = True
+
+            stdout = TestWriter()
+            utils.GLOBAL.trzsz_writer = stdout
+            for _ in range(2):
+                utils.send_integer('SUCC', 2)
+                utils.send_json('SUCC', ['d'])
+                utils.send_json('SUCC', ['d'])
+            utils.send_integer('SUCC', 0)
+            utils.GLOBAL.frame_reader.feed(stdout.getvalue())
+            stdout = TestWriter()
+            utils.GLOBAL.trzsz_writer = stdout
+            callback = TestCallback()
+            callback.nums = []
+            callback.on_num = callback.nums.append
+            files = utils.walk_paths_readable([os.path.join(src_path, 'd')], True)
+            self.assertEqual(['d'], transfer.send_files(files, callback))
+            self.assertEqual([2, 4], callback.nums)
+
+            utils.GLOBAL.frame_reader.feed(stdout.getvalue())
+            utils.GLOBAL.trzsz_writer = TestWriter()
+            self.assertEqual(['d'], transfer.recv_files(dst_path))
+            for name in ('a', 'b', 'c'):
+                with open(os.path.join(dst_path, 'd', name), 'rb') as file:
+                    self.assertEqual(name.encode('latin1') * 100, file.read())
+        finally:
+            utils.FILE_BATCH_SIZE = file_batch_size
+            shutil.rmtree(src_path)
+            shutil.rmtree(dst_path)
+
+    def test_path_index(self):
+        dst_path = tempfile.mkdtemp()
+        exists = os.path.exists
+        probes = []
+        try:
+            for name in ('a', 'a.0', 'a.1'):
+                open(os.path.join(dst_path, name), 'wb').close()
+            transfer.get_path_index().clear()
+            self.assertEqual('a.2', transfer.get_new_name(dst_path, 'a'))
+            with transfer.do_create_file(os.path.join(dst_path, 'a.2')):
+                pass
+            self.assertEqual('a.3', transfer.get_new_name(dst_path, 'a'))
+
+            os.path.exists = lambda path: probes.append(path) or exists(path)
+            utils.CONFIG.directory = True
+            utils.CONFIG.overwrite = False
+            probe_counts = []
+            for i in range(10):
+                file, _, _ = transfer.create_dir_or_file(dst_path, {
+                    'path_id': 0,
+                    'path_name': ['d', 'e', 'f%d' % i],
+                    'is_dir': False
+                })
+                file.close()
+                probe_counts.append(len(probes))
+            # only the first file probes for the new name and the parent directory
+            self.assertEqual([probe_counts[0]] * 10, probe_counts)
+            self.assertEqual(['f%d' % i for i in range(10)], sorted(os.listdir(os.path.join(dst_path, 'd', 'e'))))
+        finally:
+            os.path.exists = exists
+            utils.GLOBAL.file_name_map.clear()
+            shutil.rmtree(dst_path)
+
+    def test_unique_list(self):
+        names = utils.UniqueList()
+        for name in ('b', 'a', 'b', 'c', 'a'):
+            names.add(name)
+        self.assertEqual(['b', 'a', 'c'], names)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+# MIT License
+#
+# Copyright (c) 2023 Lonny Wong <lonnywong@qq.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import os
+import shutil
+import socket
+import tempfile
+import unittest
+from multiprocessing.pool import ThreadPool
+from .trzsz.libs import utils
+from .trzsz.libs import transfer
+
+SESSION_PAIRS = 32
+
+
+class TestTransferSession(unittest.TestCase):
+
+    def setUp(self):
+        self.src_path = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.src_path, 'd'))
+        self.files = {'a': os.urandom(64 * 1024), os.path.join('d', 'b'): os.urandom(3000), os.path.join('d', 'c'): b''}
+        for name, data in self.files.items():
+            with open(os.path.join(self.src_path, name), 'wb') as file:
+                file.write(data)
+        self.dst_paths = [tempfile.mkdtemp() for _ in range(SESSION_PAIRS)]
+
+    def tearDown(self):
+        shutil.rmtree(self.src_path)
+        for dst_path in self.dst_paths:
+            shutil.rmtree(dst_path)
+
+    def new_sessions(self, i):
+        sender_sock, receiver_sock = socket.socketpair()
+        sessions = []
+        for sock in (sender_sock, receiver_sock):
+            session = utils.TransferSession(sock.makefile('rb'), sock.makefile('wb'))
+            # each pair runs in its own mode, a shared config would mix them up
+            session.config.loads({
+                'directory': True,
+                'binary': i % 2 == 0,
+                'escape_chars': utils.get_escape_chars(i % 4 == 0),
+                'bufsize': 1024 * (i + 1),
+                'window_size': 16 * 1024 if i % 3 == 0 else 0,
+                'window_chunks': 4,
+                'pipeline_size': 4096 if i % 5 == 0 else 0,
+                'digest': ('md5', 'sha256', 'crc32')[i % 3],
+                'file_num': 4
+            })
+            sessions.append(session)
+        return sessions
+
+    def test_concurrent_sessions(self):
+        paths = [os.path.join(self.src_path, 'a'), os.path.join(self.src_path, 'd')]
+        tasks = []
+        for i, dst_path in enumerate(self.dst_paths):
+            sender, receiver = self.new_sessions(i)
+            tasks.append((sender, lambda: transfer.send_files(utils.check_paths_readable(paths, True))))
+            tasks.append((receiver, lambda dst_path=dst_path: transfer.recv_files(dst_path)))
+
+        def run(task):
+            session, func = task
+            try:
+                return session.run(func)
+            finally:
+                session.state.stdin.close()
+                session.state.trzsz_writer.close()
+
+        # every session needs its own thread, the peer blocks until it runs
+        pool = ThreadPool(len(tasks))
+        try:
+            results = pool.map(run, tasks)
+        finally:
+            pool.close()
+            pool.join()
+
+        self.assertEqual([['a', 'd']] * len(tasks), results)
+        for i, dst_path in enumerate(self.dst_paths):
+            for name, data in self.files.items():
+                with open(os.path.join(dst_path, name), 'rb') as file:
+                    self.assertEqual(data, file.read())
+            receiver = tasks[i * 2 + 1][0]
+            self.assertEqual([os.path.join(dst_path, 'a'), os.path.join(dst_path, 'd')], receiver.state.created_files)
+        self.assertEqual([], utils.DEFAULT_SESSION.state.created_files)
+        self.assertEqual(-1, utils.CONFIG.file_num)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -20,6 +20,15 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import io
+import os
+import sys
+import shutil
+import inspect
+import platform
+import time
+import tempfile
+import threading
 import unittest
 from .trzsz.libs import utils
 
@@ -36,6 +45,171 @@ class TestUtilsFunction(unittest.TestCase):
         for i in range(len(P) - 2):
             self.assertEqual('ABC123', utils.strip_tmux_status_line('ABC' + P + '123' + P[:len(P) - i]))
 
+    def test_escape_codec(self):
+        data = bytes(bytearray(range(256))) * 3 + b'\xee\xee1\xeeA\xee\xeeA~~\xee'
+        escape_sets = [[], utils.get_escape_chars(False), utils.get_escape_chars(True), [['A', 'BC'], ['B', 'BB']]]
+        for escape_chars in escape_sets:
+            codec = utils.EscapeCodec(escape_chars)
+            buf = codec.escape(data)
+            for char, _ in escape_chars:
+                if not any(char == subst[:1] for _, subst in escape_chars):
+                    self.assertNotIn(utils.latin1_bytes(char), buf)
+            self.assertEqual(data, codec.unescape(buf))
+            self.assertEqual(b'', codec.escape(b''))
+            self.assertEqual(b'0123', codec.unescape(codec.escape(b'0123')))
+        codec = utils.EscapeCodec(utils.get_escape_chars(True))
+        self.assertEqual(b'\xee\xee\xee1\xeeA\xee\xee', codec.escape(b'\xee~\x02\xee'))
+        self.assertEqual(b'\xee~\x02\xee', codec.unescape(b'\xee\xee\xee1\xeeA\xee\xee'))
+        self.assertEqual(b'\xeeZ~\xee', codec.unescape(bytearray(b'\xeeZ\xee1\xee')))
+
+    @unittest.skipIf(platform.system() == 'Windows', 'requires fcntl')
+    def test_frame_writer(self):
+        import fcntl  # pylint: disable=import-outside-toplevel
+        read_fd, write_fd = os.pipe()
+        received = []
+        reader = threading.Thread(target=lambda: received.extend(iter(lambda: os.read(read_fd, 4096), b'')))
+        reader.start()
+        try:
+            # a non-blocking pipe makes the large payload go out in many partial writes
+            fcntl.fcntl(write_fd, fcntl.F_SETFL, fcntl.fcntl(write_fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+            with os.fdopen(write_fd, 'wb') as output:
+                utils.GLOBAL.trzsz_writer = output
+                payload = bytes(bytearray(i % 251 for i in range(1024 * 1024)))
+                utils.write_frame(b'#DATA:%d\n' % len(payload), payload)
+                utils.send_line('SUCC', '1024')
+        finally:
+            utils.current_session().state = utils.GlobalVariables()
+            reader.join()
+            os.close(read_fd)
+        self.assertEqual(b'#DATA:%d\n' % len(payload) + payload + b'#SUCC:1024\n', b''.join(received))
+
+    def test_read_binary(self):
+        read_fd, write_fd = os.pipe()
+        stdin = sys.stdin
+        try:
+            sys.stdin = os.fdopen(read_fd, 'rb')
+            os.write(write_fd, b'defgh')
+            utils.GLOBAL.frame_reader.feed(b'abc')
+            self.assertEqual(b'abcdef', utils.read_binary(6))
+            self.assertEqual(b'', utils.GLOBAL.frame_reader.buffer)
+            self.assertEqual(b'gh', utils.read_binary(2))
+            utils.GLOBAL.frame_reader.feed(b'0123456789')
+            self.assertEqual(b'0123', utils.read_binary(4))
+            self.assertEqual(b'456789', utils.GLOBAL.frame_reader.buffer)
+            os.close(write_fd)
+            with self.assertRaises(utils.TrzszError):
+                utils.read_binary(10)
+        finally:
+            sys.stdin.close()
+            sys.stdin = stdin
+            utils.current_session().state = utils.GlobalVariables()
+
+    def test_recv_data_timeout(self):
+        read_fd, write_fd = os.pipe()
+        stdin = sys.stdin
+        try:
+            sys.stdin = os.fdopen(read_fd, 'rb')
+            utils.CONFIG.timeout = 0.2
+            os.write(write_fd, b'#DATA:eJxLTEoGAAJNASc=\n#DATA:')
+            self.assertEqual(b'abc', utils.recv_data())
+            self.assertIsNone(utils.GLOBAL.recv_deadline)
+            begin_time = time.time()
+            with self.assertRaises(utils.TrzszError) as ctx:
+                utils.recv_data()
+            self.assertIn('Receive data timeout', str(ctx.exception))
+            self.assertLess(time.time() - begin_time, 1)
+            self.assertIsNone(utils.GLOBAL.recv_deadline)
+
+            # only the data is received with a deadline
+            def write_later():
+                time.sleep(0.3)
+                os.write(write_fd, b'#SUCC:1\n')
+            thread = threading.Thread(target=write_later)
+            thread.start()
+            utils.GLOBAL.frame_reader.buffer = bytearray()
+            self.assertEqual(1, utils.recv_integer('SUCC'))
+            thread.join()
+        finally:
+            os.close(write_fd)
+            sys.stdin.close()
+            sys.stdin = stdin
+            utils.reset_session()
+
+    def test_read_line(self):
+        read_fd, write_fd = os.pipe()
+        stdin = sys.stdin
+        try:
+            sys.stdin = os.fdopen(read_fd, 'rb')
+            utils.GLOBAL.frame_reader.feed(b'#SUCC:1\n#DA')
+            os.write(write_fd, b'TA:' + b'A' * 50000 + b'\n#EX')
+            self.assertEqual('#SUCC:1', utils.read_line())
+            self.assertEqual(b'#DATA:' + b'A' * 50000, utils.GLOBAL.frame_reader.read_line())
+            self.assertEqual(b'#EX', utils.GLOBAL.frame_reader.buffer)
+            os.write(write_fd, b'IT:\x03\n')
+            with self.assertRaises(utils.TrzszError):
+                utils.read_line()
+        finally:
+            os.close(write_fd)
+            sys.stdin.close()
+            sys.stdin = stdin
+            utils.current_session().state = utils.GlobalVariables()
+
+    def test_frame_writer_text_stream(self):
+        stdout = io.BytesIO()
+        output = io.TextIOWrapper(stdout, encoding='latin1', newline='\r\n')
+        try:
+            utils.GLOBAL.trzsz_writer = output
+            utils.CONFIG.newline = '!\n'
+            utils.send_line('SUCC', '1024')
+            self.assertEqual(b'#SUCC:1024!\r\n', stdout.getvalue())
+        finally:
+            utils.reset_session()
+
+    def test_walk_paths_readable(self):
+        root = tempfile.mkdtemp()
+        stat_threads = utils.STAT_THREADS
+        try:
+            depth = 200
+            path = os.path.join(root, 'd')
+            os.mkdir(path)
+            for _ in range(depth):
+                path = os.path.join(path, 'x')
+                os.mkdir(path)
+            for dir_path, name in ((root, 'f'), (os.path.join(root, 'd'), 'a'), (path, 'b')):
+                with open(os.path.join(dir_path, name), 'wb') as file:
+                    file.write(name.encode('latin1'))
+
+            for utils.STAT_THREADS in (0, 4):
+                files = utils.walk_paths_readable([os.path.join(root, 'f'), os.path.join(root, 'd')], True)
+                self.assertFalse(isinstance(files, list))
+                # deeper than the recursion limit, which the walking is not limited by,
+                # the pool is left the full limit as its calls take more frames on Python 2
+                recursion_limit = sys.getrecursionlimit()
+                if utils.STAT_THREADS == 0:
+                    sys.setrecursionlimit(len(inspect.stack()) + depth // 2)
+                try:
+                    files = list(files)
+                finally:
+                    sys.setrecursionlimit(recursion_limit)
+                self.assertEqual(depth + 4, len(files))
+                self.assertEqual({'path_id': 0, 'path_name': ['f'], 'is_dir': False}, files[0].to_json())
+                self.assertEqual(os.path.join(root, 'f'), files[0].abs_path)
+                self.assertEqual(1, files[0].size)
+                self.assertEqual(['d'], files[1].path_name)
+                self.assertEqual(['d', 'a'], files[2].path_name)
+                self.assertEqual(os.path.join(root, 'd', 'a'), files[2].abs_path)
+                self.assertIs(files[1].node, files[2].node.parent)
+                self.assertEqual(['d'] + ['x'] * depth + ['b'], files[-1].path_name)
+                self.assertEqual(list(range(2, depth + 2)), [len(file.path_name) for file in files[3:-1]])
+
+            with self.assertRaises(utils.TrzszError):
+                utils.walk_paths_readable([os.path.join(root, 'd')], False)
+            with self.assertRaises(utils.TrzszError):
+                utils.walk_paths_readable([os.path.join(root, 'none')], True)
+        finally:
+            utils.STAT_THREADS = stat_threads
+            shutil.rmtree(root)
+
 
 if __name__ == '__main__':
     unittest.main()
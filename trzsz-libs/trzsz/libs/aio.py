@@ -0,0 +1,383 @@
+# MIT License
+#
+# Copyright (c) 2023 Lonny Wong <lonnywong@qq.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+# The asyncio engine of the client, for Python 3.5+. It declares the features it implements in the action, so the
+# server doesn't turn on the pipeline, resume, sync, delta, sparse or batch modes. Cancel the task to stop it.
+
+import os
+import time
+import asyncio
+import collections
+from . import utils
+from . import transfer
+
+
+async def run_blocking(func, *args):
+    # the file I/O, hashing and escaping run on the default executor, in the session of the task
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(None, utils.current_session().run, func, *args)
+
+
+async def write_frame(writer, buffers):
+    writer.writelines(buffers)
+    await writer.drain()
+
+
+async def send_line(writer, typ, buf):
+    await write_frame(writer, utils.encode_line(typ, buf))
+
+
+async def read_line(reader):
+    chunks = []
+    while True:
+        try:
+            chunks.append(await reader.readuntil(b'\n'))
+            break
+        except asyncio.LimitOverrunError as ex:
+            # a DATA line could be longer than the limit of the reader
+            chunks.append(await reader.readexactly(ex.consumed))
+        except asyncio.IncompleteReadError as ex:
+            raise utils.TrzszError('EndOfStdin', trace=False) from ex
+    line = b''.join(chunks)[:-1]
+    if b'\x03' in line:  # `ctrl + c` to interrupt
+        raise utils.TrzszError('Interrupted', trace=False)
+    return line.decode(encoding='latin1', errors='surrogateescape')
+
+
+async def recv_line(reader, expect_typ, may_has_junk=False):
+    line = await read_line(reader)
+    if utils.CONFIG.tmux_output_junk or may_has_junk:
+        if line:
+            while line[-1] == '\r':
+                line = line[:-1] + await read_line(reader)
+        line = utils.strip_tmux_status_line(utils.find_expected_line(line, expect_typ))
+    return line.strip('\x00')
+
+
+async def recv_check(reader, expect_typ, may_has_junk=False):
+    return utils.check_line(await recv_line(reader, expect_typ, may_has_junk), expect_typ)
+
+
+async def send_integer(writer, typ, value):
+    await send_line(writer, typ, str(value))
+
+
+async def recv_integer(reader, typ, may_has_junk=False):
+    return int(await recv_check(reader, typ, may_has_junk))
+
+
+async def check_integer(reader, expect):
+    result = await recv_integer(reader, 'SUCC')
+    if result != expect:
+        raise utils.TrzszError('Integer check [%d] <> [%d]' % (result, expect))
+
+
+async def send_binary(writer, typ, data):
+    await send_line(writer, typ, utils.encode_buffer(data).encode('latin1'))
+
+
+async def recv_binary(reader, typ, may_has_junk=False):
+    return utils.decode_buffer(await recv_check(reader, typ, may_has_junk))
+
+
+async def check_binary(reader, expect):
+    result = await recv_binary(reader, 'SUCC')
+    if result != expect:
+        raise utils.TrzszError('Binary check [%s] <> [%s]' % (str(result), str(expect)))
+
+
+async def send_string(writer, typ, buf):
+    await send_binary(writer, typ, buf.encode('utf8'))
+
+
+async def recv_string(reader, typ, may_has_junk=False):
+    return (await recv_binary(reader, typ, may_has_junk)).decode('utf8')
+
+
+async def check_string(reader, expect):
+    result = await recv_string(reader, 'SUCC')
+    if result != expect:
+        raise utils.TrzszError('String check [%s] <> [%s]' % (result, expect))
+
+
+async def send_json(writer, typ, dic):
+    await send_string(writer, typ, utils.encode_json(dic))
+
+
+async def recv_json(reader, typ, may_has_junk=False):
+    return utils.decode_json(await recv_string(reader, typ, may_has_junk))
+
+
+async def send_data(writer, data):
+    await write_frame(writer, await run_blocking(utils.encode_data, data))
+
+
+async def read_data(reader):
+    if not utils.CONFIG.binary:
+        return await run_blocking(utils.decode_buffer, await recv_check(reader, 'DATA'))
+    size = await recv_integer(reader, 'DATA')
+    try:
+        data = await reader.readexactly(size)
+    except asyncio.IncompleteReadError as ex:
+        raise utils.TrzszError('EndOfStdin', trace=False) from ex
+    return await run_blocking(utils.CONFIG.escape_codec.unescape, data)
+
+
+async def recv_data(reader):
+    if utils.CONFIG.timeout <= 0:
+        return await read_data(reader)
+    try:
+        return await asyncio.wait_for(read_data(reader), utils.CONFIG.timeout)
+    except asyncio.TimeoutError as ex:
+        raise utils.TrzszError('Receive data timeout', trace=False) from ex
+
+
+async def send_action(writer, confirm, version, remote_is_windows, file_num=None):
+    if remote_is_windows or utils.IS_RUNNING_ON_WINDOWS:
+        raise utils.TrzszError("The asyncio engine doesn't support Windows", trace=False)
+    action = {
+        'lang': 'py',
+        'confirm': confirm,
+        'version': version,
+        'support_dir': True,
+        'support_fast_handshake': True,
+        'support_digests': sorted(utils.DIGEST_FACTORIES),
+        'support_window': True,
+        'protocol': utils.PROTOCOL_VERSION
+    }
+    if file_num is not None:
+        action['file_num'] = file_num
+    await send_json(writer, 'ACT', action)
+
+
+async def recv_config(reader):
+    config = await recv_json(reader, 'CFG', True)
+    utils.CONFIG.loads(config)
+    return utils.CONFIG
+
+
+async def client_exit(writer, msg):
+    await send_string(writer, 'EXIT', msg)
+
+
+async def recv_exit(reader):
+    return await recv_string(reader, 'EXIT')
+
+
+async def client_error(writer, ex):
+    err_msg = utils.TrzszError.get_err_msg(ex)
+    trace = True
+    if isinstance(ex, utils.TrzszError):
+        trace = ex.trace_back()
+        if ex.is_remote_exit() or ex.is_remote_fail():
+            return err_msg
+    await send_string(writer, 'FAIL' if trace else 'fail', err_msg)
+    return err_msg
+
+
+class SendWindow:
+
+    def __init__(self, reader, callback):
+        self.reader = reader
+        self.callback = callback
+        self.acked = 0
+        self.in_flight = collections.deque()
+
+    def is_full(self, step):
+        if len(self.in_flight) >= utils.CONFIG.window_chunks:
+            return True
+        return step - self.acked >= utils.CONFIG.window_size
+
+    async def recv_ack(self):
+        acked = await recv_integer(self.reader, 'SUCC')
+        if acked not in self.in_flight:
+            raise utils.TrzszError('Integer check [%d] not in window %s' % (acked, list(self.in_flight)))
+        while self.in_flight and self.in_flight[0] <= acked:
+            self.in_flight.popleft()
+        self.acked = acked
+        if self.callback:
+            self.callback.on_step(acked)
+
+    async def send_chunk(self, step):
+        self.in_flight.append(step)
+        # the acknowledgements are a few bytes each, and no more than window_chunks of them are unread
+        while self.in_flight and self.is_full(step):
+            await self.recv_ack()
+
+    async def wait_all(self):
+        while self.in_flight:
+            await self.recv_ack()
+
+
+def read_chunk(file, size, hasher):
+    data = transfer.read_file(file, size)
+    hasher.update(data)
+    return len(data), utils.encode_data(data)
+
+
+async def send_file_data(reader, writer, file, size, callback):
+    step = 0
+    if callback:
+        callback.on_step(step)
+    buf_size = 1024
+    max_buf_size = utils.CONFIG.max_buf_size
+    window = None
+    if utils.CONFIG.window_size > 0:
+        window = SendWindow(reader, callback)
+        max_buf_size = max(min(max_buf_size, utils.CONFIG.window_size // 2), 1024)
+    hasher = utils.new_hasher()
+    while step < size:
+        begin_time = time.time()
+        length, buffers = await run_blocking(read_chunk, file, buf_size, hasher)
+        if length == 0:
+            raise utils.TrzszError('File size changed while sending', trace=False)
+        await write_frame(writer, buffers)
+        step += length
+        if window:
+            await window.send_chunk(step)
+        else:
+            await check_integer(reader, length)
+            if callback:
+                callback.on_step(step)
+        chunk_time = time.time() - begin_time
+        if length == buf_size and chunk_time < 0.5 and buf_size < max_buf_size:
+            buf_size = min(buf_size * 2, max_buf_size)
+        elif chunk_time >= 2.0 and buf_size > 1024:
+            buf_size = 1024
+    if window:
+        await window.wait_all()
+    return hasher.digest()
+
+
+async def send_files(reader, writer, file_list, callback=None):
+    file_list = list(file_list)
+
+    if utils.CONFIG.file_num < 0:
+        await send_integer(writer, 'NUM', len(file_list))
+        await check_integer(reader, len(file_list))
+    elif utils.CONFIG.file_num != len(file_list):
+        raise utils.TrzszError('Integer check [%d] <> [%d]' % (utils.CONFIG.file_num, len(file_list)))
+    if callback:
+        callback.on_num(len(file_list))
+
+    remote_list = utils.UniqueList()
+    for file in file_list:
+        if utils.CONFIG.directory:
+            await send_json(writer, 'NAME', file.to_json())
+        else:
+            await send_string(writer, 'NAME', file.name)
+        remote_list.add(await recv_string(reader, 'SUCC'))
+        if callback:
+            callback.on_name(file.name)
+
+        if file.is_dir:
+            continue
+
+        size = file.size if file.size is not None else await run_blocking(os.path.getsize, file.abs_path)
+        await send_integer(writer, 'SIZE', size)
+        await check_integer(reader, size)
+        if callback:
+            callback.on_size(size)
+
+        file_obj = await run_blocking(open, file.abs_path, 'rb')
+        try:
+            digest = await send_file_data(reader, writer, file_obj, size, callback)
+        finally:
+            await run_blocking(file_obj.close)
+
+        await send_binary(writer, 'MD5', digest)
+        await check_binary(reader, digest)
+        if callback:
+            callback.on_done()
+
+    return remote_list
+
+
+def write_chunk(file, data, hasher):
+    hasher.update(data)
+    file.write(data)
+
+
+async def recv_file_data(reader, writer, file, size, callback):
+    step = 0
+    if callback:
+        callback.on_step(step)
+    hasher = utils.new_hasher()
+    while step < size:
+        data = await recv_data(reader)
+        await run_blocking(write_chunk, file, data, hasher)
+        step += len(data)
+        if callback:
+            callback.on_step(step)
+        # acknowledge cumulatively in window mode
+        await send_integer(writer, 'SUCC', step if utils.CONFIG.window_size > 0 else len(data))
+    return hasher.digest()
+
+
+async def recv_files(reader, writer, dest_path, callback=None):
+    transfer.get_path_index().clear()
+    utils.GLOBAL.file_name_map.clear()
+
+    if utils.CONFIG.file_num < 0:
+        num = await recv_integer(reader, 'NUM')
+        await send_integer(writer, 'SUCC', num)
+    else:
+        num = utils.CONFIG.file_num
+    if callback:
+        callback.on_num(num)
+
+    local_list = utils.UniqueList()
+    for _ in range(num):
+        if utils.CONFIG.directory:
+            json_name = await recv_json(reader, 'NAME')
+            file, local_name, file_name = await run_blocking(transfer.create_dir_or_file, dest_path, json_name)
+        else:
+            file_name = await recv_string(reader, 'NAME')
+            file, local_name = await run_blocking(transfer.create_file, dest_path, file_name)
+        await send_string(writer, 'SUCC', local_name)
+        local_list.add(local_name)
+        if callback:
+            callback.on_name(file_name)
+
+        if not file:
+            continue
+
+        try:
+            size = await recv_integer(reader, 'SIZE')
+            await send_integer(writer, 'SUCC', size)
+            if callback:
+                callback.on_size(size)
+
+            digest = await recv_file_data(reader, writer, file, size, callback)
+        finally:
+            await run_blocking(file.close)
+
+        # named MD5 in the protocol, which was the only digest
+        expect_digest = await recv_binary(reader, 'MD5')
+        if digest != expect_digest:
+            raise utils.TrzszError('Check %s failed' % utils.CONFIG.digest.upper(), trace=False)
+        await send_binary(writer, 'SUCC', digest)
+        if callback:
+            callback.on_done()
+
+    return local_list
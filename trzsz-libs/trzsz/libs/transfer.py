@@ -22,23 +22,49 @@
 
 import os
 import sys
+import json
+import mmap
+import stat
+import zlib
 import time
+import errno
 import select
+import bisect
 import hashlib
+import binascii
+import itertools
+import collections
 from . import utils
 
+try:
+    import queue
+except ImportError:
+    import Queue as queue
 
-def send_action(confirm, version, remote_is_windows):
+
+def send_action(confirm, version, remote_is_windows, file_num=None):
     action = {
         'lang': 'py',
         'confirm': confirm,
         'version': version,
         'support_dir': True,
+        'support_fast_handshake': True,
+        'support_digests': sorted(utils.DIGEST_FACTORIES),
+        'support_resume': True,
+        'support_sync': True,
+        'support_delta': True,
+        'support_sparse': True,
+        'support_file_batches': True,
         'protocol': utils.PROTOCOL_VERSION
     }
+    if file_num is not None:
+        action['file_num'] = file_num
     if utils.IS_RUNNING_ON_WINDOWS or remote_is_windows:
         action['newline'] = '!\n'
         action['binary'] = False
+    else:
+        action['support_window'] = True
+        action['support_pipeline'] = True
     if remote_is_windows:
         utils.GLOBAL.windows_protocol = True
         utils.CONFIG.newline = '!\n'
@@ -52,7 +78,7 @@ def recv_action():
     return action
 
 
-def send_config(args, action, escape_chars):
+def send_config(args, action, escape_chars, file_num=None):
     config = {'lang': 'py'}
     if args.quiet:
         config['quiet'] = True
@@ -73,6 +99,40 @@ def send_config(args, action, escape_chars):
         config['tmux_pane_width'] = utils.CONFIG.tmux_pane_width
     if 'protocol' in action:
         config['protocol'] = min(action['protocol'], utils.PROTOCOL_VERSION)
+    if action.get('support_window') is True and not utils.IS_RUNNING_ON_WINDOWS:
+        config['window_size'] = utils.WINDOW_SIZE
+        config['window_chunks'] = utils.WINDOW_CHUNKS
+    if args.resume and action.get('support_resume') is True:
+        config['resume'] = True
+    elif args.delta and action.get('support_delta') is True:
+        # the existing file with the same name is the basis
+        config['delta'] = True
+        config['overwrite'] = True
+    # the resume offset and the delta blocks are positions of the whole file, holes are not skipped
+    if action.get('support_sparse') is True and 'resume' not in config and 'delta' not in config:
+        config['sparse'] = True
+    # the resume offset or the block signatures of each file take a round trip, so no pipeline mode
+    if action.get('support_pipeline') is True and not utils.IS_RUNNING_ON_WINDOWS and 'resume' not in config and \
+            'delta' not in config:
+        config['pipeline_size'] = min(utils.PIPELINE_SIZE, args.bufsize) if args.bufsize else utils.PIPELINE_SIZE
+    if args.digest != 'md5':
+        if args.digest not in action.get('support_digests', []):
+            raise utils.TrzszError("The client doesn't support the %s digest" % args.digest, trace=False)
+        config['digest'] = args.digest
+    if args.sync and action.get('support_sync') is True:
+        # the unchanged files keep their names, and the others are replaced
+        config['sync'] = True
+        config['overwrite'] = True
+    # the files are sent while walking the directories, the file number is not known
+    if file_num is None and action.get('support_file_batches') is True and 'sync' not in config:
+        config['file_batches'] = True
+    # the file number is only known after the manifest exchange in sync mode
+    if action.get('support_fast_handshake') is True and 'sync' not in config and 'file_batches' not in config:
+        # the file number is sent with the config or was sent with the action, skip the NUM message
+        if file_num is not None:
+            config['file_num'] = file_num
+        elif isinstance(action.get('file_num'), int):
+            config['file_num'] = action['file_num']
     utils.CONFIG.loads(config)
     utils.send_json('CFG', config)
 
@@ -148,90 +208,748 @@ def send_file_num(num, callback):
         callback.on_num(num)
 
 
+def send_manifest(file_list):
+    manifest = []
+    for i, file in enumerate(file_list):
+        if not file.is_dir:
+            stat_info = os.stat(file.abs_path)
+            manifest.append([i, file.path_name, stat_info.st_size, int(stat_info.st_mtime)])
+    utils.send_json('MNFT', manifest)
+    needed = set(utils.recv_json('MNFT'))
+    # the directories are always sent, they are cheap and keep the empty ones
+    return [file for i, file in enumerate(file_list) if file.is_dir or i in needed]
+
+
 def send_file_name(file, callback):
-    name = file['path_name'][-1]
+    name = file.name
     if utils.CONFIG.directory:
-        file_copy = file.copy()
-        del file_copy['abs_path']
-        utils.send_json('NAME', file_copy)
+        utils.send_json('NAME', file.to_json())
     else:
         utils.send_string('NAME', name)
-    remote_name = utils.recv_string('SUCC')
+    remote_name = None if utils.CONFIG.pipeline_size > 0 else utils.recv_string('SUCC')
     if callback:
         callback.on_name(name)
     return remote_name
 
 
 def send_file_size(file, callback):
-    file_size = os.path.getsize(file['abs_path'])
+    file_size = file.size if file.size is not None else os.path.getsize(file.abs_path)
     utils.send_integer('SIZE', file_size)
-    utils.check_integer(file_size)
+    if utils.CONFIG.pipeline_size <= 0:
+        utils.check_integer(file_size)
     if callback:
         callback.on_size(file_size)
     return file_size
 
 
-def send_file_data(file, size, callback):
-    step = 0
+class SendPipeline:
+
+    def __init__(self):
+        self.pending = 0
+        self.remote_list = utils.UniqueList()
+
+    def recv_names(self):
+        names = utils.recv_json('SUCC')
+        if not isinstance(names, list) or not 0 < len(names) <= self.pending:
+            raise utils.TrzszError('Names check [%s] with %d pending files' % (names, self.pending))
+        self.pending -= len(names)
+        for name in names:
+            self.remote_list.add(name)
+
+    def file_sent(self):
+        self.pending += 1
+        while self.pending >= utils.PIPELINE_FILES or (self.pending > 0 and utils.is_input_pending()):
+            self.recv_names()
+
+    def wait_all(self):
+        while self.pending > 0:
+            self.recv_names()
+
+
+class SendWindow:
+
+    def __init__(self, callback, pipeline=None, offset=0):
+        self.callback = callback
+        self.pipeline = pipeline
+        self.acked = offset
+        self.in_flight = collections.deque()
+
+    def is_full(self, step):
+        if len(self.in_flight) >= utils.CONFIG.window_chunks:
+            return True
+        return step - self.acked >= utils.CONFIG.window_size
+
+    def recv_ack(self):
+        if self.pipeline:
+            # the names of the previous files come before the acknowledgements
+            self.pipeline.wait_all()
+        acked = utils.recv_integer('SUCC')
+        if acked not in self.in_flight:
+            raise utils.TrzszError('Integer check [%d] not in window %s' % (acked, list(self.in_flight)))
+        while self.in_flight and self.in_flight[0] <= acked:
+            self.in_flight.popleft()
+        self.acked = acked
+        if self.callback:
+            self.callback.on_step(acked)
+
+    def send_chunk(self, step):
+        self.in_flight.append(step)
+        # read the acknowledgements as soon as they arrive, so that they never fill up the pipe
+        while self.in_flight and (self.is_full(step) or utils.is_input_pending()):
+            self.recv_ack()
+
+    def wait_all(self):
+        while self.in_flight:
+            self.recv_ack()
+
+
+class HashWorker:
+
+    def __init__(self, hasher):
+        self.hasher = hasher
+        self.queue = queue.Queue(utils.HASH_QUEUE_SIZE)
+        self.hash_time = 0
+        self.wait_time = 0
+        self.thread = utils.new_thread(self.run)
+        self.thread.start()
+
+    def run(self):
+        while True:
+            data = self.queue.get()
+            if data is None:
+                return
+            begin_time = time.time()
+            # hashlib releases the GIL for large buffers, so this overlaps with the terminal I/O
+            self.hasher.update(data)
+            self.hash_time += time.time() - begin_time
+
+    def update(self, data):
+        begin_time = time.time()
+        self.queue.put(data)
+        self.wait_time += time.time() - begin_time
+
+    def close(self):
+        if not self.thread:
+            return
+        begin_time = time.time()
+        self.queue.put(None)
+        self.thread.join()
+        self.thread = None
+        self.wait_time += time.time() - begin_time
+        utils.GLOBAL.hash_time += self.hash_time
+        utils.GLOBAL.hash_wait_time += self.wait_time
+
+    def digest(self):
+        self.close()
+        return self.hasher.digest()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, _exc_type, _exc_value, _traceback):
+        self.close()
+
+
+def read_file(file, size):
+    while True:
+        try:
+            return file.read(size)
+        except (OSError, select.error) as err:
+            if utils.is_eintr_error(err):
+                continue
+            raise
+
+
+def get_file_holes(fd, size):
+    if not hasattr(os, 'SEEK_DATA'):
+        return []
+    holes = []
+    pos = 0
+    try:
+        while pos < size:
+            try:
+                data_pos = os.lseek(fd, pos, os.SEEK_DATA)
+            except OSError as err:
+                if err.errno != errno.ENXIO:
+                    raise
+                data_pos = size  # no data after the position
+            if data_pos > pos:
+                holes.append([pos, min(data_pos, size) - pos])
+            if data_pos >= size:
+                break
+            pos = os.lseek(fd, data_pos, os.SEEK_HOLE)
+    except OSError:
+        return []  # the file system doesn't support it
+    finally:
+        os.lseek(fd, 0, os.SEEK_SET)
+    return holes
+
+
+def is_sparse_size(size):
+    return utils.CONFIG.sparse and size > max(utils.SPARSE_MIN_SIZE, utils.CONFIG.pipeline_size)
+
+
+def new_holes_hasher(holes):
+    # the zero bytes are not hashed, the digest covers the data and the holes
+    hasher = utils.new_hasher()
+    if holes:
+        hasher.update(json.dumps(holes).encode('latin1'))
+    return hasher
+
+
+class SparseFile:
+
+    def __init__(self, file, holes):
+        self.file = file
+        self.holes = holes
+        self.hole_index = 0
+        self.pos = 0
+        self.data_size = 0
+        self.hole_steps = []
+        self.hole_ends = []
+        hole_size = 0
+        for offset, length in holes:
+            self.hole_steps.append(offset - hole_size)
+            hole_size += length
+            self.hole_ends.append(offset + length)
+        self.hole_size = hole_size
+
+    def skip_holes(self):
+        # returns the size of the data before the next hole
+        while self.hole_index < len(self.holes) and self.pos == self.holes[self.hole_index][0]:
+            self.pos = self.hole_ends[self.hole_index]
+            self.file.seek(self.pos)
+            self.hole_index += 1
+        if self.hole_index < len(self.holes):
+            return self.holes[self.hole_index][0] - self.pos
+        return None
+
+    def read(self, size):
+        chunks = []
+        while size > 0:
+            limit = self.skip_holes()
+            data = read_file(self.file, size if limit is None else min(size, limit))
+            if not data:
+                break
+            chunks.append(data)
+            self.pos += len(data)
+            size -= len(data)
+        return b''.join(chunks)
+
+    def write(self, data):
+        view = memoryview(data)
+        while len(view) > 0:
+            limit = self.skip_holes()
+            length = len(view) if limit is None else min(len(view), limit)
+            self.file.write(view[:length])
+            self.pos += length
+            view = view[length:]
+
+    def file_offset(self, step):
+        # the data step in the file, counting the holes before it
+        index = bisect.bisect_right(self.hole_steps, step)
+        return step + (self.hole_ends[index - 1] - self.hole_steps[index - 1] if index > 0 else 0)
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, _exc_type, _exc_value, _traceback):
+        self.close()
+
+
+class SparseProgress:
+
+    def __init__(self, callback, sparse_file):
+        self.callback = callback
+        self.sparse_file = sparse_file
+
+    def on_step(self, step):
+        self.callback.on_step(self.sparse_file.file_offset(step))
+
+
+class MappedFile:
+
+    def __init__(self, file):
+        self.file = file
+        self.mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.mmap)
+        self.pos = 0
+        self.released = 0
+        if hasattr(self.mmap, 'madvise') and hasattr(mmap, 'MADV_SEQUENTIAL'):
+            self.mmap.madvise(mmap.MADV_SEQUENTIAL)
+
+    def read(self, size):
+        # the slices are sent, hashed and written without copying into bytes
+        data = self.view[self.pos:self.pos + size]
+        self.pos += len(data)
+        self.release_pages(self.pos - (utils.HASH_QUEUE_SIZE + 2) * size)
+        return data
+
+    def release_pages(self, end):
+        # the sent pages count in the RSS until dropped, they are read again from the page cache if needed
+        end -= end % mmap.PAGESIZE
+        if end - self.released < utils.MMAP_RELEASE_SIZE or not hasattr(mmap, 'MADV_DONTNEED'):
+            return
+        self.mmap.madvise(mmap.MADV_DONTNEED, self.released, end - self.released)
+        self.released = end
+
+    def seek(self, pos):
+        self.pos = pos
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        self.view.release()
+        try:
+            self.mmap.close()
+        except BufferError:
+            pass  # closed once the slices still in use are released
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, _exc_type, _exc_value, _traceback):
+        self.close()
+
+
+def open_file(path):
+    file = open(path, 'rb')  # pylint: disable=consider-using-with
+    # memoryview of mmap requires Python 3
+    if utils.MMAP_MIN_SIZE <= 0 or sys.version_info < (3, ):
+        return file
+    file_stat = os.fstat(file.fileno())
+    if not stat.S_ISREG(file_stat.st_mode) or file_stat.st_size < utils.MMAP_MIN_SIZE:
+        return file
+    try:
+        return MappedFile(file)
+    except (OSError, ValueError):
+        return file
+
+
+class PrefetchedFile:
+
+    def __init__(self, read_ahead, index):
+        self.read_ahead = read_ahead
+        self.index = index
+
+    def read(self, size):
+        return self.read_ahead.read(self.index, size)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, _exc_type, _exc_value, _traceback):
+        pass
+
+
+class ReadAhead:
+
+    def __init__(self, file_list, depth):
+        self.files = [file for file in file_list if not file.is_dir]
+        self.next_index = 0
+        self.buf_size = 1024
+        self.pending = None
+        self.stopped = False
+        self.thread = None
+        if depth > 0 and self.files:
+            self.queue = queue.Queue(depth)
+            self.thread = utils.new_thread(self.run)
+            self.thread.start()
+
+    def run(self):
+        try:
+            for index, file in enumerate(self.files):
+                if self.stopped:
+                    return
+                self.read_chunks(index, file)
+        except Exception as ex:  # raised on the transfer thread
+            self.queue.put((None, ex))
+
+    def read_chunks(self, index, file):
+        with open_file(file.abs_path) as file_obj:
+            size = os.fstat(file_obj.fileno()).st_size
+            # the data extents of sparse files are read by the transfer thread, an empty chunk marks the slot
+            if is_sparse_size(size) and get_file_holes(file_obj.fileno(), size):
+                self.queue.put((index, b''))
+                return
+            if 0 < size <= utils.CONFIG.pipeline_size:
+                self.queue.put((index, read_file(file_obj, size)))
+                return
+            pos = 0
+            while pos < size and not self.stopped:
+                # the sender adjusts the chunk size, the next read follows its latest size
+                data = read_file(file_obj, min(self.buf_size, size - pos))
+                if not data:
+                    return
+                pos += len(data)
+                self.queue.put((index, data))
+
+    def open(self, file):
+        if not self.thread:
+            return open_file(file.abs_path)
+        self.next_index += 1
+        return PrefetchedFile(self, self.next_index - 1)
+
+    def skip(self):
+        # the file is read by the transfer thread, its slot is dropped by reading the next file
+        if self.thread:
+            self.next_index += 1
+
+    def read(self, index, size):
+        self.buf_size = size
+        while True:
+            if self.pending is None:
+                self.pending = self.queue.get()
+            file_index, data = self.pending
+            if file_index is None:
+                raise data
+            if file_index > index:
+                # the file is shorter than expected, leave the next file alone
+                return b''
+            self.pending = None
+            if file_index == index:
+                return data
+
+    def close(self):
+        if not self.thread:
+            return
+        self.stopped = True
+        # unblock the reading thread, it stops before reading the next chunk
+        try:
+            while True:
+                self.queue.get_nowait()
+        except queue.Empty:
+            pass
+        self.thread.join()
+        self.thread = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, _exc_type, _exc_value, _traceback):
+        self.close()
+
+
+def send_small_file_data(file, size, callback):
+    if callback:
+        callback.on_step(0)
+    data = read_file(file, size)
+    if len(data) != size:
+        raise utils.TrzszError('File size changed while sending', trace=False)
+    utils.send_data(data)
+    if callback:
+        callback.on_step(len(data))
+    hasher = utils.new_hasher()
+    hasher.update(data)
+    return hasher.digest()
+
+
+def send_file_data(file, size, callback, pipeline=None, offset=0, hasher=None):  # pylint: disable=too-many-arguments
+    # small files are sent in one chunk without acknowledgement in pipeline mode
+    if 0 < size <= utils.CONFIG.pipeline_size:
+        return send_small_file_data(file, size, callback)
+    # the file is read from the offset, and the hasher has hashed the bytes before it
+    step = offset
     if callback:
         callback.on_step(step)
     buf_size = 1024
-    md5 = hashlib.md5()
-    while step < size:
-        begin_time = time.time()
+    max_buf_size = utils.CONFIG.max_buf_size
+    window = None
+    if utils.CONFIG.window_size > 0:
+        window = SendWindow(callback, pipeline, offset)
+        # keep at least two chunks in flight
+        max_buf_size = max(min(max_buf_size, utils.CONFIG.window_size // 2), 1024)
+    with HashWorker(hasher or utils.new_hasher()) as hasher:
+        while step < size:
+            begin_time = time.time()
+            data = read_file(file, buf_size)
+            length = len(data)
+            if length == 0:
+                raise utils.TrzszError('File size changed while sending', trace=False)
+            utils.send_data(data)
+            hasher.update(data)
+            step += length
+            if window:
+                window.send_chunk(step)
+            else:
+                if pipeline:
+                    pipeline.wait_all()
+                utils.check_integer(length)
+                if callback:
+                    callback.on_step(step)
+            chunk_time = time.time() - begin_time
+            if length == buf_size and chunk_time < 0.5 and buf_size < max_buf_size:
+                buf_size = min(buf_size * 2, max_buf_size)
+            elif chunk_time >= 2.0 and buf_size > 1024:
+                buf_size = 1024
+            if chunk_time > utils.GLOBAL.max_chunk_time:
+                utils.GLOBAL.max_chunk_time = chunk_time
+        if window:
+            window.wait_all()
+        return hasher.digest()
+
+
+def hash_file_prefix(file, size):
+    hasher = utils.new_hasher()
+    length = 0
+    while length < size:
+        data = read_file(file, min(size - length, 1024 * 1024))
+        if not data:
+            break
+        hasher.update(data)
+        length += len(data)
+    return length, hasher
+
+
+def send_file_offset(file, size):
+    # the receiver may have the beginning of the file from an interrupted transfer
+    offset_info = utils.recv_json('OFST')
+    offset = offset_info.get('offset', 0)
+    hasher = None
+    if 0 < offset <= size:
+        length, hasher = hash_file_prefix(file, offset)
+        digest = binascii.hexlify(hasher.copy().digest()).decode('latin1')
+        if length != offset or digest != offset_info.get('digest'):
+            offset = 0
+    else:
+        offset = 0
+    if offset == 0:
+        file.seek(0)
+        hasher = None
+    utils.send_integer('OFST', offset)
+    return offset, hasher
+
+
+def roll_adler32(checksum, block_size, out_byte, in_byte):
+    a = ((checksum & 0xffff) - out_byte + in_byte) % 65521
+    b = ((checksum >> 16) - block_size * out_byte + a - 1) % 65521
+    return (b << 16) | a
+
+
+def generate_delta(file, block_size, signatures, hasher):
+    # yields the literal bytes, or the index of a block of the receiver
+    if not signatures:
         while True:
-            try:
-                data = file.read(buf_size)
-                break
-            except (OSError, select.error) as err:
-                if utils.is_eintr_error(err):
-                    continue
-                raise
-        length = len(data)
-        utils.send_data(data)
-        md5.update(data)
-        utils.check_integer(length)
-        step += length
-        if callback:
-            callback.on_step(step)
-        chunk_time = time.time() - begin_time
-        if length == buf_size and chunk_time < 0.5 and buf_size < utils.CONFIG.max_buf_size:
-            buf_size = min(buf_size * 2, utils.CONFIG.max_buf_size)
-        elif chunk_time >= 2.0 and buf_size > 1024:
-            buf_size = 1024
-        if chunk_time > utils.GLOBAL.max_chunk_time:
-            utils.GLOBAL.max_chunk_time = chunk_time
-    return md5.digest()
-
-
-def send_file_md5(digest, callback):
+            data = read_file(file, utils.DELTA_BATCH_SIZE)
+            if not data:
+                return
+            hasher.update(data)
+            yield data
+    data = bytearray()
+    pos = 0
+    lit_start = 0
+    checksum = None
+    eof = False
+    while True:
+        if len(data) <= pos + block_size and not eof:
+            del data[:lit_start]
+            pos -= lit_start
+            lit_start = 0
+            buf = read_file(file, max(block_size, utils.DELTA_BATCH_SIZE))
+            if not buf:
+                eof = True
+            data += buf
+            continue
+        if len(data) < pos + block_size:
+            break
+        if checksum is None:
+            checksum = zlib.adler32(bytes(data[pos:pos + block_size])) & 0xffffffff
+        strong_map = signatures.get(checksum)
+        if strong_map:
+            index = strong_map.get(hashlib.md5(data[pos:pos + block_size]).hexdigest())
+            if index is not None:
+                if pos > lit_start:
+                    hasher.update(bytes(data[lit_start:pos]))
+                    yield bytes(data[lit_start:pos])
+                hasher.update(bytes(data[pos:pos + block_size]))
+                yield index
+                pos += block_size
+                lit_start = pos
+                checksum = None
+                continue
+        if pos - lit_start >= utils.DELTA_ROLLING_LIMIT:
+            # the file differs too much, only search the blocks aligned to the literal bytes
+            pos += block_size
+            checksum = None
+        elif len(data) > pos + block_size:
+            checksum = roll_adler32(checksum, block_size, data[pos], data[pos + block_size])
+            pos += 1
+        else:
+            break
+        if pos - lit_start >= utils.DELTA_BATCH_SIZE + utils.DELTA_ROLLING_LIMIT:
+            hasher.update(bytes(data[lit_start:pos - utils.DELTA_ROLLING_LIMIT]))
+            yield bytes(data[lit_start:pos - utils.DELTA_ROLLING_LIMIT])
+            lit_start = pos - utils.DELTA_ROLLING_LIMIT
+    if len(data) > lit_start:
+        hasher.update(bytes(data[lit_start:]))
+        yield bytes(data[lit_start:])
+
+
+def send_delta_batch(ops, literals, step, callback):
+    utils.send_json('DLTA', ops)
+    if literals:
+        utils.send_data(b''.join(literals))
+    utils.check_integer(step)
+    if callback:
+        callback.on_step(step)
+
+
+def send_file_delta(file, size, callback):
+    # the receiver sends the signatures of the blocks of its existing file
+    signature_info = utils.recv_json('SIGS')
+    block_size = signature_info['block_size']
+    signatures = {}
+    for index, (checksum, strong) in enumerate(signature_info['signatures']):
+        signatures.setdefault(checksum, {}).setdefault(strong, index)
+    step = 0
+    if callback:
+        callback.on_step(step)
+    ops, literals, batch_size = [], [], 0
+    with HashWorker(utils.new_hasher()) as hasher:
+        for item in generate_delta(file, block_size, signatures, hasher):
+            if isinstance(item, bytes):
+                ops.append([0, len(item)])
+                literals.append(item)
+                length = len(item)
+            else:
+                ops.append([1, item])
+                length = block_size
+            step += length
+            batch_size += length
+            if batch_size >= utils.DELTA_BATCH_SIZE:
+                send_delta_batch(ops, literals, step, callback)
+                ops, literals, batch_size = [], [], 0
+        if ops:
+            send_delta_batch(ops, literals, step, callback)
+        if step != size:
+            raise utils.TrzszError('File size changed while sending', trace=False)
+        utils.send_json('DLTA', [])
+        return hasher.digest()
+
+
+def send_file_digest(digest, callback):
     utils.send_binary('MD5', digest)
-    utils.check_binary(digest)
+    if utils.CONFIG.pipeline_size <= 0:
+        utils.check_binary(digest)
     if callback:
         callback.on_done()
 
 
+def send_sparse_file_data(file, size, callback, pipeline):
+    holes = []
+    file_obj = open(file.abs_path, 'rb')  # pylint: disable=consider-using-with
+    try:
+        holes = get_file_holes(file_obj.fileno(), size)
+        utils.send_json('HOLE', holes)
+    finally:
+        if not holes:
+            file_obj.close()
+    if not holes:
+        return None
+    with SparseFile(file_obj, holes) as sparse_file:
+        progress = SparseProgress(callback, sparse_file) if callback else None
+        data_size = size - sparse_file.hole_size
+        return send_file_data(sparse_file, data_size, progress, pipeline, hasher=new_holes_hasher(holes))
+
+
+def send_file_content(file, size, callback, read_ahead, pipeline=None):
+    if is_sparse_size(size):
+        digest = send_sparse_file_data(file, size, callback, pipeline)
+        if digest is not None:
+            read_ahead.skip()
+            return digest
+    with read_ahead.open(file) as file_obj:
+        if utils.CONFIG.delta:
+            return send_file_delta(file_obj, size, callback)
+        offset, hasher = send_file_offset(file_obj, size) if utils.CONFIG.resume else (0, None)
+        return send_file_data(file_obj, size, callback, pipeline, offset, hasher)
+
+
+def send_files_pipelined(file_list, callback, read_ahead):
+    pipeline = SendPipeline()
+    for file in file_list:
+        send_file_name(file, callback)
+
+        if not file.is_dir:
+            size = send_file_size(file, callback)
+
+            digest = send_file_content(file, size, callback, read_ahead, pipeline)
+
+            send_file_digest(digest, callback)
+
+        pipeline.file_sent()
+
+    pipeline.wait_all()
+    return pipeline.remote_list
+
+
+def send_file_batches(files, callback):
+    remote_list = utils.UniqueList()
+    total = 0
+    batch = []
+    for file in itertools.chain(files, [None]):
+        if file is not None:
+            batch.append(file)
+        if batch and (file is None or len(batch) >= utils.FILE_BATCH_SIZE):
+            send_file_num(len(batch), None)
+            total += len(batch)
+            if callback:
+                callback.on_num(total)
+            for remote_name in send_file_list(batch, callback):
+                remote_list.add(remote_name)
+            batch = []
+    # no more files
+    send_file_num(0, None)
+    return remote_list
+
+
 def send_files(file_list, callback=None):
-    send_file_num(len(file_list), callback)
+    if utils.CONFIG.file_batches:
+        return send_file_batches(file_list, callback)
 
-    remote_list = []
-    for file in file_list:
-        remote_name = send_file_name(file, callback)
+    file_list = list(file_list)
 
-        if remote_name not in remote_list:
-            remote_list.append(remote_name)
+    if utils.CONFIG.sync:
+        file_list = send_manifest(file_list)
 
-        if file['is_dir']:
-            continue
+    if utils.CONFIG.file_num < 0:
+        send_file_num(len(file_list), callback)
+    elif utils.CONFIG.file_num != len(file_list):
+        raise utils.TrzszError('Integer check [%d] <> [%d]' % (utils.CONFIG.file_num, len(file_list)))
+    elif callback:
+        callback.on_num(len(file_list))
 
-        size = send_file_size(file, callback)
+    return send_file_list(file_list, callback)
 
-        with open(file['abs_path'], 'rb') as file_obj:
-            md5 = send_file_data(file_obj, size, callback)
 
-        send_file_md5(md5, callback)
+def send_file_list(file_list, callback):
+    # the files are read from the resume offsets or by the delta generator, not in chunks known ahead
+    read_ahead_chunks = 0 if utils.CONFIG.resume or utils.CONFIG.delta else utils.READ_AHEAD_CHUNKS
+    with ReadAhead(file_list, read_ahead_chunks) as read_ahead:
+        if utils.CONFIG.pipeline_size > 0:
+            return send_files_pipelined(file_list, callback, read_ahead)
 
-    return remote_list
+        remote_list = utils.UniqueList()
+        for file in file_list:
+            remote_name = send_file_name(file, callback)
+
+            remote_list.add(remote_name)
+
+            if file.is_dir:
+                continue
+
+            size = send_file_size(file, callback)
+
+            digest = send_file_content(file, size, callback, read_ahead)
+
+            send_file_digest(digest, callback)
+
+        return remote_list
 
 
 def recv_file_num(callback):
@@ -242,20 +960,105 @@ def recv_file_num(callback):
     return num
 
 
+def recv_manifest(dest_path):
+    needed = []
+    mtimes = {}
+    for i, path_name, size, mtime in utils.recv_json('MNFT'):
+        path = os.path.join(dest_path, *path_name)
+        if os.path.isfile(path) and os.path.getsize(path) == size and int(os.path.getmtime(path)) == mtime:
+            continue
+        needed.append(i)
+        mtimes[path] = mtime
+    utils.send_json('MNFT', needed)
+    return mtimes
+
+
+def set_file_mtime(path, mtimes):
+    # the received files get the mtime of the source, so the next sync skips them
+    if path in mtimes:
+        os.utime(path, (mtimes[path], mtimes[path]))
+
+
+class PathIndex:
+    """The receiver's snapshot of the destination, so each file costs O(1) filesystem probes."""
+
+    def __init__(self):
+        self.listings = {}
+        self.dirs = set()
+
+    def clear(self):
+        self.listings.clear()
+        self.dirs.clear()
+
+    def listing(self, path):
+        path = os.path.normpath(path)
+        names = self.listings.get(path)
+        if names is None:
+            try:
+                names = set(os.listdir(path))
+            except OSError:
+                names = set()
+            self.listings[path] = names
+        return names
+
+    def exists(self, path, name):
+        names = self.listing(path)
+        if name in names:
+            return True
+        # a name missing from the listing is confirmed, the filesystem may be case insensitive
+        if os.path.exists(os.path.join(path, name)):
+            names.add(name)
+            return True
+        return False
+
+    def add(self, path):
+        parent, name = os.path.split(os.path.normpath(path))
+        names = self.listings.get(parent)
+        if names is not None:
+            names.add(name)
+
+    def create_directory(self, path):
+        if path in self.dirs:
+            return
+        if do_create_directory(path):
+            self.listings[os.path.normpath(path)] = set()
+            self.add(path)
+        self.dirs.add(path)
+
+
+def get_path_index():
+    if utils.GLOBAL.path_index is None:
+        utils.GLOBAL.path_index = PathIndex()
+    return utils.GLOBAL.path_index
+
+
 def get_new_name(path, name):
-    if not os.path.exists(os.path.join(path, name)):
+    path_index = get_path_index()
+    if not path_index.exists(path, name):
         return name
+    # continue receiving the file interrupted last time
+    if utils.CONFIG.resume and load_journal(os.path.join(path, name)):
+        return name
+    names = path_index.listing(path)
     for i in range(1000):
         new_name = '%s.%d' % (name, i)
-        if not os.path.exists(os.path.join(path, new_name)):
+        if new_name not in names and not path_index.exists(path, new_name):
             return new_name
     raise utils.TrzszError('Fail to assign new file name', trace=False)
 
 
 def do_create_file(path):
     try:
-        file = open(path, 'wb')  # pylint: disable=consider-using-with
+        if utils.CONFIG.delta and os.path.isfile(path):
+            # the existing file is the basis, the new file is written to a temporary file
+            file = open(path, 'rb')  # pylint: disable=consider-using-with
+        elif utils.CONFIG.resume and load_journal(path):
+            # keep the received bytes, they are truncated once the offset is agreed
+            file = open(path, 'r+b')  # pylint: disable=consider-using-with
+        else:
+            file = open(path, 'wb')  # pylint: disable=consider-using-with
         utils.add_created_files(path)
+        get_path_index().add(path)
         return file
     except IOError as ex:
         if ex.errno == 21 or (utils.IS_RUNNING_ON_WINDOWS and os.path.isdir(path)):
@@ -271,12 +1074,13 @@ def do_create_directory(path):
     if not os.path.exists(path):
         try:
             os.makedirs(path, 0o755)
-            utils.add_created_files(path)
-            return
+            utils.add_created_files(path, True)
+            return True
         except OSError:
             raise utils.TrzszError("Fail to create directory: %s" % path, trace=False)
     if not os.path.isdir(path):
         raise utils.TrzszError('Not a directory: %s' % path, trace=False)
+    return False
 
 
 def create_file(path, file_name):
@@ -288,9 +1092,6 @@ def create_file(path, file_name):
     return file, local_name
 
 
-file_name_map = {}
-
-
 def create_dir_or_file(path, file):
     if 'path_name' not in file or 'path_id' not in file or 'is_dir' not in file or len(file['path_name']) < 1:
         raise utils.TrzszError('Invalid name: %s' % path, trace=False)
@@ -300,6 +1101,7 @@ def create_dir_or_file(path, file):
     if utils.CONFIG.overwrite:
         local_name = file['path_name'][0]
     else:
+        file_name_map = utils.GLOBAL.file_name_map
         if file['path_id'] in file_name_map:
             local_name = file_name_map[file['path_id']]
         else:
@@ -308,13 +1110,13 @@ def create_dir_or_file(path, file):
 
     if len(file['path_name']) > 1:
         parent_path = os.path.join(path, local_name, *file['path_name'][1:-1])
-        do_create_directory(parent_path)
+        get_path_index().create_directory(parent_path)
         full_path = os.path.join(parent_path, file_name)
     else:
         full_path = os.path.join(path, local_name)
 
     if file['is_dir']:
-        do_create_directory(full_path)
+        get_path_index().create_directory(full_path)
         return None, local_name, file_name
     file = do_create_file(full_path)
     return file, local_name, file_name
@@ -327,7 +1129,8 @@ def recv_file_name(path, callback):
     else:
         file_name = utils.recv_string('NAME')
         file, local_name = create_file(path, file_name)
-    utils.send_string('SUCC', local_name)
+    if utils.CONFIG.pipeline_size <= 0:
+        utils.send_string('SUCC', local_name)
     if callback:
         callback.on_name(file_name)
     return file, local_name
@@ -335,58 +1138,475 @@ def recv_file_name(path, callback):
 
 def recv_file_size(callback):
     file_size = utils.recv_integer('SIZE')
-    utils.send_integer('SUCC', file_size)
+    if utils.CONFIG.pipeline_size <= 0:
+        utils.send_integer('SUCC', file_size)
     if callback:
         callback.on_size(file_size)
     return file_size
 
 
-def recv_file_data(file, size, callback):
+class RecvPipeline:
+
+    def __init__(self):
+        self.names = []
+
+    def file_received(self, local_name):
+        self.names.append(local_name)
+
+    def flush(self):
+        if self.names:
+            utils.send_json('SUCC', self.names)
+            self.names = []
+
+    def flush_if_idle(self):
+        # batch the names until the sender is waiting for them
+        if len(self.names) >= utils.PIPELINE_FILES or not utils.is_input_pending():
+            self.flush()
+
+
+class WriteBehind:
+
+    def __init__(self, file, depth):
+        self.file = file
+        self.error = None
+        self.thread = None
+        if depth > 0:
+            self.queue = queue.Queue(depth)
+            self.thread = utils.new_thread(self.run)
+            self.thread.start()
+
+    def run(self):
+        while True:
+            data = self.queue.get()
+            if data is None:
+                return
+            if self.error is not None:
+                continue  # keep taking the chunks, so that the transfer thread never blocks
+            try:
+                self.file.write(data)
+            except Exception as ex:  # raised on the transfer thread
+                self.error = ex
+
+    def write(self, data):
+        if self.error is not None:
+            raise self.error
+        if self.thread:
+            self.queue.put(data)
+        else:
+            self.file.write(data)
+
+    def close(self):
+        if self.thread:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+        if self.error is not None:
+            raise self.error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, _exc_value, _traceback):
+        if exc_type is None:
+            self.close()
+        elif self.thread:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+
+
+def sync_path(path):
+    fd = os.open(path, os.O_RDWR)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class FileSyncer:
+
+    def __init__(self, durability):
+        self.durability = durability
+        self.paths = []
+
+    def file_written(self, file):
+        if self.durability == utils.DURABILITY_FILE:
+            file.flush()
+            os.fsync(file.fileno())
+        elif self.durability == utils.DURABILITY_END:
+            file.flush()
+            self.paths.append(file.name)
+
+    def sync_all(self):
+        for path in self.paths:
+            sync_path(path)
+        self.paths = []
+
+
+def get_journal_path(path):
+    return path + '.trzsz-journal'
+
+
+def load_journal(path):
+    try:
+        with open(get_journal_path(path), 'r') as file:
+            journal = json.load(file)
+        return journal if isinstance(journal, dict) else None
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def save_journal(path, size):
+    journal_path = get_journal_path(path)
+    if not os.path.exists(journal_path):
+        utils.add_created_files(journal_path)
+    with open(journal_path, 'w') as file:
+        json.dump({'size': size, 'digest': utils.CONFIG.digest}, file)
+
+
+def remove_journal(path):
+    try:
+        os.remove(get_journal_path(path))
+    except OSError:
+        pass
+
+
+def recv_file_offset(file, size):
+    offset, hasher = 0, None
+    journal = load_journal(file.name)
+    # only a verifiable prefix of the same file is resumed
+    if journal and journal.get('size') == size and journal.get('digest') == utils.CONFIG.digest and \
+            utils.CONFIG.digest != 'none':
+        offset, hasher = hash_file_prefix(file, size)
+    digest = binascii.hexlify(hasher.copy().digest()).decode('latin1') if hasher else ''
+    utils.send_json('OFST', {'offset': offset, 'digest': digest})
+    accepted = utils.recv_integer('OFST')
+    if accepted not in (0, offset):
+        raise utils.TrzszError('Integer check [%d] <> [%d]' % (accepted, offset))
+    if accepted == 0:
+        hasher = None
+    file.seek(accepted)
+    file.truncate()
+    save_journal(file.name, size)
+    return accepted, hasher
+
+
+def get_delta_block_size(size):
+    block_size = int(size**0.5) // 1024 * 1024
+    return max(utils.DELTA_MIN_BLOCK_SIZE, min(block_size, utils.DELTA_MAX_BLOCK_SIZE))
+
+
+def send_file_signatures(file):
+    signatures = []
+    # a new file is opened for writing, and has no blocks
+    if 'r' not in file.mode:
+        utils.send_json('SIGS', {'block_size': utils.DELTA_MIN_BLOCK_SIZE, 'signatures': signatures})
+        return utils.DELTA_MIN_BLOCK_SIZE, 0
+    file.seek(0, os.SEEK_END)
+    block_size = get_delta_block_size(file.tell())
+    file.seek(0)
+    while True:
+        data = read_file(file, block_size)
+        if len(data) < block_size:
+            break
+        signatures.append([zlib.adler32(data) & 0xffffffff, hashlib.md5(data).hexdigest()])
+    utils.send_json('SIGS', {'block_size': block_size, 'signatures': signatures})
+    return block_size, len(signatures)
+
+
+def recv_file_delta(file, size, callback, delta_file):
+    block_size, block_num = send_file_signatures(file)
     step = 0
     if callback:
         callback.on_step(step)
-    md5 = hashlib.md5()
-    while step < size:
-        begin_time = time.time()
-        data = utils.recv_data()
-        file.write(data)
-        step += len(data)
-        if callback:
-            callback.on_step(step)
-        utils.send_integer('SUCC', len(data))
-        md5.update(data)
-        chunk_time = time.time() - begin_time
-        if chunk_time > utils.GLOBAL.max_chunk_time:
-            utils.GLOBAL.max_chunk_time = chunk_time
-    return md5.digest()
+    with HashWorker(utils.new_hasher()) as hasher:
+        while True:
+            ops = utils.recv_json('DLTA')
+            if not ops:
+                break
+            literal = utils.recv_data() if any(op[0] == 0 for op in ops) else b''
+            literal_pos = 0
+            for op_type, value in ops:
+                if op_type == 0:
+                    data = literal[literal_pos:literal_pos + value]
+                    literal_pos += value
+                elif 0 <= value < block_num:
+                    file.seek(value * block_size)
+                    data = read_file(file, block_size)
+                else:
+                    raise utils.TrzszError('Invalid delta block: %d' % value)
+                hasher.update(data)
+                delta_file.write(data)
+                step += len(data)
+            if callback:
+                callback.on_step(step)
+            utils.send_integer('SUCC', step)
+        if step != size:
+            raise utils.TrzszError('Delta size check [%d] <> [%d]' % (step, size))
+        return hasher.digest()
+
+
+def replace_file(src_path, dst_path):
+    if hasattr(os, 'replace'):
+        os.replace(src_path, dst_path)
+        return
+    if os.path.exists(dst_path):
+        os.remove(dst_path)
+    os.rename(src_path, dst_path)
+
+
+def recv_small_file_data(file, size, callback):
+    if callback:
+        callback.on_step(0)
+    data = utils.recv_data()
+    if len(data) != size:
+        raise utils.TrzszError('Size check [%d] <> [%d]' % (len(data), size))
+    file.write(data)
+    if callback:
+        callback.on_step(size)
+    hasher = utils.new_hasher()
+    hasher.update(data)
+    return hasher.digest()
 
 
-def recv_file_md5(digest, callback):
+def recv_file_data(file, size, callback, pipeline=None, offset=0, hasher=None):  # pylint: disable=too-many-arguments
+    if 0 < size <= utils.CONFIG.pipeline_size:
+        return recv_small_file_data(file, size, callback)
+    step = offset
+    if callback:
+        callback.on_step(step)
+    with HashWorker(hasher or utils.new_hasher()) as hasher:
+        while step < size:
+            begin_time = time.time()
+            data = utils.recv_data()
+            hasher.update(data)
+            file.write(data)
+            step += len(data)
+            if callback:
+                callback.on_step(step)
+            if pipeline:
+                pipeline.flush()
+            # acknowledge cumulatively in window mode
+            utils.send_integer('SUCC', step if utils.CONFIG.window_size > 0 else len(data))
+            chunk_time = time.time() - begin_time
+            if chunk_time > utils.GLOBAL.max_chunk_time:
+                utils.GLOBAL.max_chunk_time = chunk_time
+        return hasher.digest()
+
+
+def recv_file_digest(digest, callback):
+    # named MD5 in the protocol, which was the only digest
     expect_digest = utils.recv_binary('MD5')
     if digest != expect_digest:
-        raise utils.TrzszError('Check MD5 failed', trace=False)
-    utils.send_binary('SUCC', digest)
+        raise utils.TrzszError('Check %s failed' % utils.CONFIG.digest.upper(), trace=False)
+    if utils.CONFIG.pipeline_size <= 0:
+        utils.send_binary('SUCC', digest)
     if callback:
         callback.on_done()
 
 
-def recv_files(dest_path, callback=None):
-    num = recv_file_num(callback)
+def recv_sparse_file_data(file, size, callback, pipeline):
+    holes = utils.recv_json('HOLE')
+    pos = 0
+    for offset, length in holes:
+        if offset < pos or length <= 0 or offset + length > size:
+            raise utils.TrzszError('Invalid hole: %d, %d' % (offset, length))
+        pos = offset + length
+    sparse_file = SparseFile(file, holes)
+    progress = SparseProgress(callback, sparse_file) if callback else None
+    with WriteBehind(sparse_file, utils.WRITE_BEHIND_CHUNKS) as writer:
+        data_size = size - sparse_file.hole_size
+        digest = recv_file_data(writer, data_size, progress, pipeline, hasher=new_holes_hasher(holes))
+    # the holes at the end are not written
+    file.truncate(size)
+    return digest
+
+
+def preallocate_file(file, offset, size):
+    if utils.PREALLOCATE_MIN_SIZE <= 0 or size - offset <= utils.PREALLOCATE_MIN_SIZE or \
+            not hasattr(os, 'posix_fallocate'):
+        return False
+    try:
+        os.posix_fallocate(file.fileno(), offset, size - offset)
+        return True
+    except OSError as err:
+        if err.errno != errno.ENOSPC:
+            return False  # the file system doesn't support it
+        file.truncate(offset)
+        raise utils.TrzszError('No space left on device: %s needs %d bytes' % (file.name, size - offset), trace=False)
 
-    local_list = []
+
+class MappedWriter:
+
+    def __init__(self, file, offset, size):
+        # the file is opened for writing only, and mmap needs to read too
+        self.fd = os.open(file.name, os.O_RDWR)
+        try:
+            self.mmap = mmap.mmap(self.fd, size)
+        except Exception:
+            os.close(self.fd)
+            raise
+        self.pos = offset
+
+    def write(self, data):
+        end = self.pos + len(data)
+        if end > len(self.mmap):
+            raise utils.TrzszError('File size check [%d] <> [%d]' % (end, len(self.mmap)))
+        self.mmap[self.pos:end] = data
+        self.pos = end
+
+    def tell(self):
+        return self.pos
+
+    def close(self):
+        self.mmap.close()
+        os.close(self.fd)
+
+
+def recv_preallocated_file_data(file, size, callback, pipeline, offset, hasher):  # pylint: disable=too-many-arguments
+    target = file
+    if utils.MMAP_MIN_SIZE > 0 and size >= utils.MMAP_MIN_SIZE:
+        try:
+            target = MappedWriter(file, offset, size)
+        except (OSError, ValueError):
+            pass
+    try:
+        with WriteBehind(target, utils.WRITE_BEHIND_CHUNKS) as writer:
+            return recv_file_data(writer, size, callback, pipeline, offset, hasher)
+    except Exception:
+        # the allocated space after the received data is not kept, so that resuming sees the right size
+        position = target.tell()
+        if target is not file:
+            target.close()
+            target = file
+        file.truncate(position)
+        raise
+    finally:
+        if target is not file:
+            target.close()
+
+
+def recv_file_delta_content(file, callback, syncer):
+    delta_path = file.name + '.trzsz-delta'
+    with file:
+        size = recv_file_size(callback)
+        utils.add_created_files(delta_path)
+        with open(delta_path, 'wb') as delta_file:
+            digest = recv_file_delta(file, size, callback, delta_file)
+            syncer.file_written(delta_file)
+    # the basis is closed before being replaced, which is required on Windows
+    replace_file(delta_path, file.name)
+    return digest
+
+
+def recv_file_content(file, callback, syncer, pipeline=None):
+    if utils.CONFIG.delta:
+        return recv_file_delta_content(file, callback, syncer)
+    with file:
+        size = recv_file_size(callback)
+        if is_sparse_size(size):
+            digest = recv_sparse_file_data(file, size, callback, pipeline)
+        else:
+            offset, hasher = recv_file_offset(file, size) if utils.CONFIG.resume else (0, None)
+            # a killed receiver leaves the allocated zeros, and resuming from the file size would hash them
+            if not utils.CONFIG.resume and preallocate_file(file, offset, size):
+                digest = recv_preallocated_file_data(file, size, callback, pipeline, offset, hasher)
+            else:
+                # the chunks are acknowledged once queued, and written to disk on another thread
+                with WriteBehind(file, utils.WRITE_BEHIND_CHUNKS) as writer:
+                    digest = recv_file_data(writer, size, callback, pipeline, offset, hasher)
+        syncer.file_written(file)
+    return digest
+
+
+def recv_files_pipelined(dest_path, num, callback, mtimes):
+    pipeline = RecvPipeline()
+    syncer = FileSyncer(utils.GLOBAL.durability)
+    local_list = utils.UniqueList()
     for _ in range(num):
+        pipeline.flush_if_idle()
+
         file, local_name = recv_file_name(dest_path, callback)
 
-        if local_name not in local_list:
-            local_list.append(local_name)
+        local_list.add(local_name)
+
+        if file:
+            digest = recv_file_content(file, callback, syncer, pipeline)
+
+            recv_file_digest(digest, callback)
+
+            set_file_mtime(file.name, mtimes)
+
+        pipeline.file_received(local_name)
+
+    # the last names are the final acknowledgement
+    syncer.sync_all()
+    pipeline.flush()
+    return local_list
+
+
+def recv_file_batches(dest_path, callback):
+    local_list = utils.UniqueList()
+    total = 0
+    while True:
+        num = recv_file_num(None)
+        if num == 0:
+            return local_list
+        total += num
+        if callback:
+            callback.on_num(total)
+        for local_name in recv_file_list(dest_path, num, callback, {}):
+            local_list.add(local_name)
+
+
+def recv_files(dest_path, callback=None):
+    get_path_index().clear()
+    utils.GLOBAL.file_name_map.clear()
+
+    if utils.CONFIG.file_batches:
+        return recv_file_batches(dest_path, callback)
+
+    mtimes = recv_manifest(dest_path) if utils.CONFIG.sync else {}
+
+    if utils.CONFIG.file_num < 0:
+        num = recv_file_num(callback)
+    else:
+        num = utils.CONFIG.file_num
+        if callback:
+            callback.on_num(num)
+
+    return recv_file_list(dest_path, num, callback, mtimes)
+
+
+def recv_file_list(dest_path, num, callback, mtimes):
+    if utils.CONFIG.pipeline_size > 0:
+        return recv_files_pipelined(dest_path, num, callback, mtimes)
+
+    syncer = FileSyncer(utils.GLOBAL.durability)
+    local_list = utils.UniqueList()
+    for i in range(num):
+        # the name of a trailing directory is the final acknowledgement
+        if utils.CONFIG.directory and i == num - 1:
+            syncer.sync_all()
+
+        file, local_name = recv_file_name(dest_path, callback)
+
+        local_list.add(local_name)
 
         if not file:
             continue
 
-        with file:
-            size = recv_file_size(callback)
-            md5 = recv_file_data(file, size, callback)
+        digest = recv_file_content(file, callback, syncer)
+        set_file_mtime(file.name, mtimes)
+
+        # the digest of the last file is the final acknowledgement
+        if i == num - 1:
+            syncer.sync_all()
+
+        recv_file_digest(digest, callback)
 
-        recv_file_md5(md5, callback)
+        if utils.CONFIG.resume:
+            remove_journal(file.name)
 
+    syncer.sync_all()
     return local_list
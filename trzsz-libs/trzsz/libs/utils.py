@@ -28,24 +28,127 @@ import stat
 import time
 import zlib
 import errno
+import io
 import atexit
 import base64
+import struct
+import hashlib
 import select
 import shutil
 import signal
 import argparse
 import platform
+import threading
 import traceback
 import subprocess
 
 PROTOCOL_VERSION = 1
 
+# at most WINDOW_SIZE bytes or WINDOW_CHUNKS chunks unacknowledged in window mode
+WINDOW_SIZE = 16 * 1024 * 1024
+WINDOW_CHUNKS = 32
+
+# files up to PIPELINE_SIZE bytes are sent in one chunk, at most PIPELINE_FILES files unconfirmed in pipeline mode
+PIPELINE_SIZE = 1024 * 1024
+PIPELINE_FILES = 100
+
+# at most READ_AHEAD_CHUNKS chunks of at most bufsize are read from disk ahead of the sending, 0 to disable
+READ_AHEAD_CHUNKS = 2
+
+# the delta block size is about the square root of the file size, like rsync
+DELTA_MIN_BLOCK_SIZE = 2 * 1024
+DELTA_MAX_BLOCK_SIZE = 128 * 1024
+# rolling byte by byte is slow, block aligned searching is used after so many literal bytes without a match
+DELTA_ROLLING_LIMIT = 1024 * 1024
+# the literal bytes and block references are acknowledged in batches of about DELTA_BATCH_SIZE bytes
+DELTA_BATCH_SIZE = 1024 * 1024
+
+# the holes of files larger than SPARSE_MIN_SIZE are sent as extents instead of zero bytes
+SPARSE_MIN_SIZE = 1024 * 1024
+
+# regular files of at least MMAP_MIN_SIZE are read, and preallocated files written, through mmap, 0 to disable.
+# disabled by default, it measured no faster than read, see benchmarks/bench_mmap.py
+MMAP_MIN_SIZE = 0
+# the mapped pages already sent are released every MMAP_RELEASE_SIZE bytes
+MMAP_RELEASE_SIZE = 16 * 1024 * 1024
+
+# the received files larger than PREALLOCATE_MIN_SIZE are allocated once the size is known, 0 to disable
+PREALLOCATE_MIN_SIZE = 1024 * 1024
+
+# the entries of a directory are checked by STAT_THREADS threads, for slow file systems like NFS, 0 to disable
+STAT_THREADS = 0
+
+# the files are sent in batches of FILE_BATCH_SIZE while walking the directories, if the client supports
+FILE_BATCH_SIZE = 1000
+
+# at most WRITE_BEHIND_CHUNKS received chunks are waiting to be written to disk, 0 to disable
+WRITE_BEHIND_CHUNKS = 4
+
+# the received files are flushed to disk never, before the last acknowledgement, or before each file's
+DURABILITY_NONE = 'none'
+DURABILITY_END = 'end'
+DURABILITY_FILE = 'file'
+
+# at most HASH_QUEUE_SIZE chunks waiting to be hashed on the hashing thread
+HASH_QUEUE_SIZE = 4
+
 NO_TMUX_MODE = 0
 TMUX_NORMAL_MODE = 1
 TMUX_CONTROL_MODE = 2
 
 IS_RUNNING_ON_WINDOWS = platform.system() == 'Windows'
 
+# the read size of FrameReader adapts to how fast the input comes
+MIN_READ_SIZE = 32 * 1024
+MAX_READ_SIZE = 4 * 1024 * 1024
+
+
+class FrameReader:
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.read_size = MIN_READ_SIZE
+
+    def feed(self, buf):
+        self.buffer += buf
+
+    def read_more(self):
+        buf = read_buffer(self.read_size)
+        # read more at a time while the peer keeps the pipe full
+        if len(buf) == self.read_size:
+            self.read_size = min(self.read_size * 2, MAX_READ_SIZE)
+        elif len(buf) < self.read_size // 4:
+            self.read_size = max(self.read_size // 2, MIN_READ_SIZE)
+        self.buffer += buf
+
+    def read_line(self, delimiter=b'\n'):
+        searched = 0
+        while True:
+            idx = self.buffer.find(delimiter, searched)
+            end = idx if idx >= 0 else len(self.buffer)
+            if self.buffer.find(b'\x03', searched, end) >= 0:  # `ctrl + c` to interrupt
+                raise TrzszError('Interrupted', trace=False)
+            if idx >= 0:
+                line = memoryview(self.buffer)[:idx].tobytes()
+                # +1 to ignore the delimiter
+                del self.buffer[:idx + 1]
+                return line
+            # only the new bytes need to be searched next time
+            searched = len(self.buffer)
+            self.read_more()
+
+    def read_binary(self, size):
+        data = bytearray(size)
+        view = memoryview(data)
+        # the peer may have sent more than this chunk in window mode
+        length = min(len(self.buffer), size)
+        view[:length] = memoryview(self.buffer)[:length]
+        del self.buffer[:length]
+        # read the rest of the chunk into place, never beyond it
+        while length < size:
+            length += read_into(view[length:])
+        return data
+
 
 class GlobalVariables:
 
@@ -53,15 +156,145 @@ class GlobalVariables:
         self.stdin_old_tty = None
         self.tmux_mode = NO_TMUX_MODE
         self.trzsz_writer = sys.stdout
+        self.frame_writer = None
         self.windows_protocol = False
-        self.next_read_buffer = b''
+        self.frame_reader = FrameReader()
         self.clean_timeout = 0.1
         self.max_chunk_time = 0
+        self.hash_time = 0
+        self.hash_wait_time = 0
+        self.durability = DURABILITY_NONE
         self.stopped = False
+        self.recv_deadline = None
+        self.stdin = None
         self.created_files = []
+        self.created_dirs = set()
+        self.file_name_map = {}
+        self.path_index = None
+
+
+def latin1_bytes(buf):
+    # the escape chars are str of Python 2 or 3, or unicode from the JSON config
+    if isinstance(buf, bytes):
+        return buf
+    return buf.encode('latin1')
+
+
+class EscapeCodec:
+
+    def __init__(self, escape_chars):
+        self.escape_chars = escape_chars
+        pairs = [(latin1_bytes(p), latin1_bytes(s)) for p, s in escape_chars]
+        self.prefix = self.get_common_prefix(pairs)
+        self.escape_pattern = None
+        if self.prefix:
+            # replace the prefix first, so that the following replacements are not escaped again
+            self.escape_pairs = [(self.prefix, self.prefix * 2)]
+            self.escape_pairs.extend((p, s) for p, s in pairs if p != self.prefix)
+            # the code after each prefix is split out in one pass, unknown codes are kept as they are
+            codes = [bytes(bytearray([i])) for i in range(256)]
+            self.unescape_table = dict((code, self.prefix + code) for code in codes)
+            self.unescape_table.update((s[1:], p) for p, s in pairs)
+            self.unescape_pattern = re.compile(re.escape(self.prefix) + b'(.)', re.DOTALL)
+        elif pairs:
+            self.escape_table = dict(pairs)
+            self.unescape_table = dict((s, p) for p, s in pairs)
+            self.escape_pattern = re.compile(b'|'.join(re.escape(p) for p, s in pairs))
+            self.unescape_pattern = re.compile(b'|'.join(re.escape(s) for p, s in pairs))
 
+    @staticmethod
+    def get_common_prefix(pairs):
+        # the known escape chars: the prefix is escaped to itself twice, others to the prefix with an unescaped char
+        prefix = pairs[0][1][:1] if pairs else None
+        if not prefix or (prefix, prefix * 2) not in pairs:
+            return None
+        chars = set(p for p, s in pairs)
+        codes = set()
+        for char, subst in pairs:
+            if len(char) != 1 or len(subst) != 2 or subst[:1] != prefix:
+                return None
+            code = subst[1:]
+            if code in codes or (char != prefix and code in chars):
+                return None
+            codes.add(code)
+        return prefix
+
+    def escape(self, data):
+        if self.prefix:
+            if not isinstance(data, bytes):
+                data = bytes(data)  # a memoryview of a mapped file
+            # bytes.replace runs in C and returns quickly when there is nothing to replace
+            for char, subst in self.escape_pairs:
+                data = data.replace(char, subst)
+            return data
+        if self.escape_pattern:
+            return self.escape_pattern.sub(lambda m: self.escape_table[m.group(0)], data)
+        return data
 
-GLOBAL = GlobalVariables()
+    def unescape(self, data):
+        if sys.version_info < (3, ) and isinstance(data, bytearray):
+            data = bytes(data)  # the split parts of Python 2 are bytearray, which can't be looked up
+        if self.prefix:
+            if data.find(self.prefix) < 0:
+                return data
+            parts = self.unescape_pattern.split(data)
+            parts[1::2] = map(self.unescape_table.__getitem__, parts[1::2])
+            return b''.join(parts)
+        if self.escape_pattern:
+            return self.unescape_pattern.sub(lambda m: self.unescape_table[m.group(0)], data)
+        return data
+
+    def __eq__(self, other):
+        return isinstance(other, EscapeCodec) and self.escape_chars == other.escape_chars
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+
+class ChecksumHasher:
+
+    def __init__(self, func, initial):
+        self.func = func
+        self.value = initial
+
+    def update(self, data):
+        self.value = self.func(data, self.value)
+
+    def copy(self):
+        return ChecksumHasher(self.func, self.value)
+
+    def digest(self):
+        return struct.pack('>I', self.value & 0xffffffff)
+
+
+class NoneHasher:
+
+    def update(self, data):
+        pass
+
+    def copy(self):
+        return self
+
+    def digest(self):
+        return b''
+
+
+DIGEST_FACTORIES = {
+    'md5': hashlib.md5,
+    'sha256': hashlib.sha256,
+    'crc32': lambda: ChecksumHasher(zlib.crc32, 0),
+    'adler32': lambda: ChecksumHasher(zlib.adler32, 1),
+    'none': NoneHasher,
+}
+if hasattr(hashlib, 'blake2b'):
+    DIGEST_FACTORIES['blake2b'] = hashlib.blake2b
+
+
+def new_hasher(digest=None):
+    digest = digest or CONFIG.digest
+    if digest not in DIGEST_FACTORIES:
+        raise TrzszError('Unsupported digest: %s' % digest, trace=False)
+    return DIGEST_FACTORIES[digest]()
 
 
 class TransferConfig:
@@ -76,8 +309,19 @@ class TransferConfig:
         self.protocol = 0
         self.max_buf_size = 10 * 1024 * 1024
         self.escape_chars = []
+        self.escape_codec = EscapeCodec(self.escape_chars)
         self.tmux_pane_width = 0
         self.tmux_output_junk = False
+        self.window_size = 0
+        self.window_chunks = 0
+        self.pipeline_size = 0
+        self.file_num = -1
+        self.digest = 'md5'
+        self.resume = False
+        self.sync = False
+        self.delta = False
+        self.sparse = False
+        self.file_batches = False
 
     def loads(self, config):
         self.quiet = config.get('quiet', self.quiet)
@@ -89,11 +333,93 @@ class TransferConfig:
         self.protocol = config.get('protocol', self.protocol)
         self.max_buf_size = config.get('bufsize', self.max_buf_size)
         self.escape_chars = config.get('escape_chars', self.escape_chars)
+        self.escape_codec = EscapeCodec(self.escape_chars)
         self.tmux_pane_width = config.get('tmux_pane_width', self.tmux_pane_width)
         self.tmux_output_junk = config.get('tmux_output_junk', self.tmux_output_junk)
+        self.window_size = config.get('window_size', self.window_size)
+        self.window_chunks = config.get('window_chunks', self.window_chunks)
+        self.pipeline_size = config.get('pipeline_size', self.pipeline_size)
+        self.file_num = config.get('file_num', self.file_num)
+        self.digest = config.get('digest', self.digest)
+        self.resume = config.get('resume', self.resume)
+        self.sync = config.get('sync', self.sync)
+        self.delta = config.get('delta', self.delta)
+        self.sparse = config.get('sparse', self.sparse)
+        self.file_batches = config.get('file_batches', self.file_batches)
+
+
+class TransferSession:
+    """The config and the state of a transfer, CONFIG and GLOBAL are those of the session running on the thread."""
+
+    local = threading.local()
 
+    def __init__(self, stdin=None, writer=None):
+        self.config = TransferConfig()
+        self.state = GlobalVariables()
+        self.state.stdin = stdin
+        if writer is not None:
+            self.state.trzsz_writer = writer
 
-CONFIG = TransferConfig()
+    def reset(self):
+        self.config = TransferConfig()
+        self.state = GlobalVariables()
+
+    def run(self, func, *args, **kwargs):
+        with self:
+            return func(*args, **kwargs)
+
+    def __enter__(self):
+        sessions = getattr(TransferSession.local, 'sessions', None)
+        if sessions is None:
+            sessions = TransferSession.local.sessions = []
+        sessions.append(self)
+        return self
+
+    def __exit__(self, _exc_type, _exc_value, _traceback):
+        TransferSession.local.sessions.pop()
+
+
+DEFAULT_SESSION = TransferSession()
+
+
+def current_session():
+    sessions = getattr(TransferSession.local, 'sessions', None)
+    return sessions[-1] if sessions else DEFAULT_SESSION
+
+
+def reset_session():
+    current_session().reset()
+
+
+class SessionProxy(object):
+    """Forwards to the config or the state of the current session."""
+
+    __slots__ = ('name', )
+
+    def __init__(self, name):
+        object.__setattr__(self, 'name', name)
+
+    @property
+    def __dict__(self):
+        return vars(getattr(current_session(), self.name))
+
+    def __getattr__(self, key):
+        return getattr(getattr(current_session(), self.name), key)
+
+    def __setattr__(self, key, value):
+        setattr(getattr(current_session(), self.name), key, value)
+
+
+CONFIG = SessionProxy('config')
+GLOBAL = SessionProxy('state')
+
+
+def new_thread(target):
+    # the thread works for the session that starts it
+    session = current_session()
+    thread = threading.Thread(target=session.run, args=(target, ))
+    thread.daemon = True
+    return thread
 
 if IS_RUNNING_ON_WINDOWS:
     # pylint: disable-next=unused-import
@@ -242,17 +568,22 @@ def is_eintr_error(err):
     return err_no == errno.EINTR
 
 
+def get_stdin():
+    return sys.stdin if GLOBAL.stdin is None else GLOBAL.stdin
+
+
 def clean_input(timeout):
     GLOBAL.stopped = True
     if IS_RUNNING_ON_WINDOWS:
         time.sleep(timeout)
         return
+    stdin = get_stdin()
     while True:
         try:
-            rlist, _wlist, _xlist = select.select([sys.stdin], [], [], timeout)
+            rlist, _wlist, _xlist = select.select([stdin], [], [], timeout)
             if not rlist:
                 break
-            if not os.read(sys.stdin.fileno(), 32 * 1024):
+            if not os.read(stdin.fileno(), 32 * 1024):
                 break
         except (OSError, select.error) as err:
             if is_eintr_error(err):
@@ -270,20 +601,101 @@ def decode_buffer(buf):
     try:
         return zlib.decompress(base64.b64decode(buf))
     except (TypeError, zlib.error) as ex:
+        if isinstance(buf, memoryview):
+            buf = buf.tobytes().decode('latin1')
         raise TrzszError(buf, str(ex))
 
 
+class FrameWriter:
+
+    def __init__(self, output):
+        self.output = output
+        self.fd = None
+        if not IS_RUNNING_ON_WINDOWS:
+            try:
+                self.fd = output.fileno()
+            except (AttributeError, ValueError, IOError, OSError):
+                self.fd = None
+
+    def write(self, buffers):
+        if self.fd is None:
+            self.write_stream(buffers)
+            return
+        # anything written through the stream should go out first
+        self.output.flush()
+        views = [memoryview(buf) for buf in buffers if buf]
+        while views:
+            try:
+                if hasattr(os, 'writev'):
+                    written = os.writev(self.fd, views)
+                else:
+                    written = os.write(self.fd, views[0])
+            except (OSError, IOError) as err:
+                if is_eintr_error(err):
+                    continue
+                if err.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    select.select([], [self.fd], [])
+                    continue
+                raise
+            # drop what has been written, the rest is written again without copying
+            while views and written >= len(views[0]):
+                written -= len(views[0])
+                views.pop(0)
+            if written > 0:
+                views[0] = views[0][written:]
+
+    def write_stream(self, buffers):
+        # text streams translate the newline, e.g. on Windows
+        is_text = isinstance(self.output, io.TextIOBase)
+        for buf in buffers:
+            self.output.write(buf.decode('latin1') if is_text else buf)
+        self.output.flush()
+
+
+def write_frame(*buffers):
+    if GLOBAL.frame_writer is None or GLOBAL.frame_writer.output is not GLOBAL.trzsz_writer:
+        GLOBAL.frame_writer = FrameWriter(GLOBAL.trzsz_writer)
+    GLOBAL.frame_writer.write(buffers)
+
+
+def encode_line(typ, buf):
+    if not isinstance(buf, bytes):
+        buf = buf.encode('utf8')
+    return [('#%s:' % typ).encode('latin1'), buf, CONFIG.newline.encode('latin1')]
+
+
 def send_line(typ, buf):
-    GLOBAL.trzsz_writer.write('#%s:%s%s' % (typ, buf, CONFIG.newline))
-    GLOBAL.trzsz_writer.flush()
+    write_frame(*encode_line(typ, buf))
+
+
+monotonic_time = getattr(time, 'monotonic', time.time)
+
+
+def wait_input(fd):
+    if GLOBAL.recv_deadline is None:
+        return
+    while True:
+        remaining = GLOBAL.recv_deadline - monotonic_time()
+        if remaining <= 0:
+            break
+        try:
+            rlist, _wlist, _xlist = select.select([fd], [], [], remaining)
+            if rlist:
+                return
+        except (OSError, select.error) as err:
+            if is_eintr_error(err):
+                continue
+            raise
+    GLOBAL.clean_timeout = 3
+    raise TrzszError('Receive data timeout', trace=False)
 
 
 def read_buffer(size):
-    if GLOBAL.next_read_buffer:
-        return GLOBAL.next_read_buffer
+    fd = get_stdin().fileno()
     while True:
         try:
-            buf = os.read(sys.stdin.fileno(), size)
+            wait_input(fd)
+            buf = os.read(fd, size)
             break
         except (OSError, select.error) as err:
             if is_eintr_error(err):
@@ -294,33 +706,48 @@ def read_buffer(size):
     return buf
 
 
+def is_input_pending():
+    if GLOBAL.frame_reader.buffer:
+        return True
+    if IS_RUNNING_ON_WINDOWS:
+        return False
+    while True:
+        try:
+            rlist, _wlist, _xlist = select.select([get_stdin()], [], [], 0)
+            return bool(rlist)
+        except (OSError, select.error) as err:
+            if is_eintr_error(err):
+                continue
+            raise
+
+
 def read_line():
-    buffer = []
+    return GLOBAL.frame_reader.read_line().decode(encoding='latin1', errors='surrogateescape')
+
+
+def read_into(view):
+    fd = get_stdin().fileno()
     while True:
-        buf = read_buffer(32 * 1024)
-        new_line_idx = buf.find(b'\n')
-        if new_line_idx >= 0:
-            # +1 to ignroe the '\n'
-            GLOBAL.next_read_buffer = buf[new_line_idx + 1:]
-            buf = buf[:new_line_idx]
-        else:
-            GLOBAL.next_read_buffer = b''
-        if buf.find(b'\x03') >= 0:  # `ctrl + c` to interrupt
-            raise TrzszError('Interrupted', trace=False)
-        buffer.append(buf)
-        if new_line_idx >= 0:
-            return b''.join(buffer).decode(encoding='latin1', errors='surrogateescape')
+        try:
+            wait_input(fd)
+            if hasattr(os, 'readv'):
+                length = os.readv(fd, [view])
+            else:
+                buf = os.read(fd, len(view))
+                length = len(buf)
+                view[:length] = buf
+            break
+        except (OSError, select.error) as err:
+            if is_eintr_error(err):
+                continue
+            raise
+    if not length:
+        raise TrzszError('EndOfStdin', trace=False)
+    return length
 
 
 def read_binary(size):
-    length = 0
-    buffer = []
-    while length < size:
-        buf = read_buffer(size - length)
-        GLOBAL.next_read_buffer = b''
-        length += len(buf)
-        buffer.append(buf)
-    return b''.join(buffer)
+    return GLOBAL.frame_reader.read_binary(size)
 
 
 def is_vt100_end(char):
@@ -352,18 +779,9 @@ def read_line_on_windows():  # pylint: disable=too-many-branches
     has_cursor_home = False
     pre_has_cursor_home = False
     while True:
-        buf = read_buffer(32 * 1024)
-        new_line_idx = buf.find(b'!')
-        if new_line_idx >= 0:
-            # +1 to ignroe the '\n'
-            GLOBAL.next_read_buffer = buf[new_line_idx + 1:]
-            buf = buf[:new_line_idx]
-        else:
-            GLOBAL.next_read_buffer = b''
+        buf = GLOBAL.frame_reader.read_line(b'!')
         for i in range(len(buf)):
             char = buf[i:i + 1]
-            if char == b'\x03':  # `ctrl + c` to interrupt
-                raise TrzszError('Interrupted', trace=False)
             if char == b'\n':
                 has_new_line = True
             if skip_vt100:
@@ -389,7 +807,7 @@ def read_line_on_windows():  # pylint: disable=too-many-branches
                 pre_has_cursor_home = has_cursor_home
                 has_cursor_home = False
                 has_new_line = False
-        if new_line_idx >= 0 and len(buffer) > 0 and not skip_vt100:
+        if len(buffer) > 0 and not skip_vt100:
             return b''.join(buffer).decode(encoding='latin1', errors='surrogateescape')
 
 
@@ -414,37 +832,36 @@ def strip_tmux_status_line(buf):
         buf = buf[:begin_idx] + buf[buf_idx:]
 
 
+def find_expected_line(line, expect_typ):
+    # skip the junk before the line
+    idx = line.rfind('#' + expect_typ + ':')
+    if idx >= 0:
+        return line[idx:]
+    idx = line.rfind('#')
+    if idx > 0:
+        return line[idx:]
+    return line
+
+
 def recv_line(expect_typ, may_has_junk=False):
     if GLOBAL.stopped:
         raise TrzszError('Stopped', trace=False)
     if IS_RUNNING_ON_WINDOWS or GLOBAL.windows_protocol:
-        line = read_line_on_windows()
-        idx = line.rfind('#' + expect_typ + ':')
-        if idx >= 0:
-            line = line[idx:]
-        else:
-            idx = line.rfind('#')
-            if idx > 0:
-                line = line[idx:]
-        return line
+        return find_expected_line(read_line_on_windows(), expect_typ)
     line = read_line()
     if CONFIG.tmux_output_junk or may_has_junk:
         if line:
             while line[-1] == '\r':
                 line = line[:-1] + read_line()
-        idx = line.rfind('#' + expect_typ + ':')
-        if idx >= 0:
-            line = line[idx:]
-        else:
-            idx = line.rfind('#')
-            if idx > 0:
-                line = line[idx:]
-        line = strip_tmux_status_line(line)
+        line = strip_tmux_status_line(find_expected_line(line, expect_typ))
     return line.strip('\x00')
 
 
 def recv_check(expect_typ, may_has_junk=False):
-    line = recv_line(expect_typ, may_has_junk)
+    return check_line(recv_line(expect_typ, may_has_junk), expect_typ)
+
+
+def check_line(line, expect_typ):
     idx = line.find(':')
     if idx < 1:
         raise TrzszError(encode_buffer(line.encode('utf8')), 'colon')
@@ -472,7 +889,7 @@ def check_integer(expect):
 def send_string(typ, buf):
     if sys.version_info >= (3, ) or isinstance(buf, unicode):
         buf = buf.encode('utf8')
-    send_line(typ, encode_buffer(buf))
+    send_binary(typ, buf)
 
 
 def recv_string(typ, may_has_junk=False):
@@ -486,11 +903,20 @@ def check_string(expect):
 
 
 def send_binary(typ, data):
-    send_line(typ, encode_buffer(data))
+    send_line(typ, base64.b64encode(zlib.compress(data)))
 
 
 def recv_binary(typ, may_has_junk=False):
-    return decode_buffer(recv_check(typ, may_has_junk))
+    if may_has_junk or CONFIG.tmux_output_junk or IS_RUNNING_ON_WINDOWS or GLOBAL.windows_protocol:
+        return decode_buffer(recv_check(typ, may_has_junk))
+    if GLOBAL.stopped:
+        raise TrzszError('Stopped', trace=False)
+    # decode the line as bytes, it could be a large DATA chunk
+    line = GLOBAL.frame_reader.read_line().strip(b'\x00')
+    prefix = ('#%s:' % typ).encode('latin1')
+    if not line.startswith(prefix):
+        return decode_buffer(check_line(line.decode(encoding='latin1', errors='surrogateescape'), typ))
+    return decode_buffer(memoryview(line)[len(prefix):])
 
 
 def check_binary(expect):
@@ -508,72 +934,65 @@ def get_escape_chars(escape_all):
 
 
 def escape_data(data, escape_chars):
-    if not escape_chars:
-        return data
-    pattern = b'|'.join(b'(%s)' % re.escape(p.encode('latin1')) for p, s in escape_chars)
-    substs = [s.encode('latin1') for p, s in escape_chars]
-    return re.sub(pattern, lambda m: substs[m.lastindex - 1], data)
+    return EscapeCodec(escape_chars).escape(data)
 
 
 def unescape_data(data, escape_chars):
-    if not escape_chars:
-        return data
-    pattern = b'|'.join(b'(%s)' % re.escape(s.encode('latin1')) for p, s in escape_chars)
-    substs = [p.encode('latin1') for p, s in escape_chars]
-    return re.sub(pattern, lambda m: substs[m.lastindex - 1], data)
+    return EscapeCodec(escape_chars).unescape(data)
 
 
-def send_data(data):
+def encode_data(data):
     if not CONFIG.binary:
-        send_binary('DATA', data)
-        return
-    buf = escape_data(data, CONFIG.escape_chars)
-    out = GLOBAL.trzsz_writer.buffer if hasattr(GLOBAL.trzsz_writer, 'buffer') else GLOBAL.trzsz_writer
-    out.write(b'#DATA:%d\n%s' % (len(buf), buf))
-    out.flush()
-
-
-def recv_timeout(_signum, _frame):
-    GLOBAL.clean_timeout = 3
-    raise TrzszError('Receive data timeout', trace=False)
+        return encode_line('DATA', base64.b64encode(zlib.compress(data)))
+    buf = CONFIG.escape_codec.escape(data)
+    return [('#DATA:%d\n' % len(buf)).encode('latin1'), buf]
 
 
-if not IS_RUNNING_ON_WINDOWS:
-    signal.signal(signal.SIGALRM, recv_timeout)
+def send_data(data):
+    write_frame(*encode_data(data))
 
 
 def recv_data():
+    # the reader waits for the input until the deadline, select doesn't work on the Windows console
     if CONFIG.timeout > 0 and not IS_RUNNING_ON_WINDOWS:
-        signal.alarm(CONFIG.timeout)
+        GLOBAL.recv_deadline = monotonic_time() + CONFIG.timeout
     try:
         if not CONFIG.binary:
             return recv_binary('DATA')
         size = recv_integer('DATA')
         data = read_binary(size)
-        return unescape_data(data, CONFIG.escape_chars)
+        return CONFIG.escape_codec.unescape(data)
     finally:
-        if CONFIG.timeout > 0 and not IS_RUNNING_ON_WINDOWS:
-            signal.alarm(0)
+        GLOBAL.recv_deadline = None
 
 
-def send_json(typ, dic):
-    send_string(typ, json.dumps(dic, encoding='latin1') if sys.version_info < (3, ) else json.dumps(dic))
+def encode_json(dic):
+    return json.dumps(dic, encoding='latin1') if sys.version_info < (3, ) else json.dumps(dic)
 
 
-def recv_json(typ, may_has_junk=False):
-    dic = recv_string(typ, may_has_junk)
+def decode_json(dic):
     try:
         return json.loads(dic, encoding='latin1') if sys.version_info < (3, ) else json.loads(dic)
     except ValueError as ex:
         raise TrzszError(dic, str(ex))
 
 
+def send_json(typ, dic):
+    send_string(typ, encode_json(dic))
+
+
+def recv_json(typ, may_has_junk=False):
+    return decode_json(recv_string(typ, may_has_junk))
+
+
 def stop_transferring():
     if GLOBAL.stopped:
         return
     GLOBAL.stopped = True
     GLOBAL.clean_timeout = max(GLOBAL.max_chunk_time * 2, 0.5)
-    os.kill(os.getpid(), signal.SIGINT)
+    # other sessions see the stopped flag, the signal interrupts the main thread
+    if current_session() is DEFAULT_SESSION:
+        os.kill(os.getpid(), signal.SIGINT)
 
 
 def terminate(_signum, _frame):
@@ -600,44 +1019,149 @@ def check_path_writable(dest_path):
     return True
 
 
-def check_path_readable(path_id, path, mode, file_list, rel_path, visited_dir):  # pylint: disable=too-many-arguments
+intern_name = getattr(sys, 'intern', lambda name: name)
+
+
+class PathNode:
+    """A path component, the nodes of a directory tree share their parents."""
+
+    __slots__ = ('parent', 'name')
+
+    def __init__(self, parent, name):
+        self.parent = parent
+        self.name = intern_name(name)
+
+    def path_name(self):
+        names = []
+        node = self
+        while node is not None:
+            names.append(node.name)
+            node = node.parent
+        names.reverse()
+        return names
+
+
+class FileEntry:
+    """A file or directory to be sent, the path is built from the nodes when needed."""
+
+    __slots__ = ('path_id', 'base_dir', 'node', 'is_dir', 'size')
+
+    def __init__(self, path_id, base_dir, node, is_dir, size=None):  # pylint: disable=too-many-arguments
+        self.path_id = path_id
+        self.base_dir = base_dir
+        self.node = node
+        self.is_dir = is_dir
+        self.size = size
+
+    @property
+    def name(self):
+        return self.node.name
+
+    @property
+    def path_name(self):
+        return self.node.path_name()
+
+    @property
+    def abs_path(self):
+        return os.path.join(self.base_dir, *self.path_name)
+
+    def to_json(self):
+        return {'path_id': self.path_id, 'path_name': self.path_name, 'is_dir': self.is_dir}
+
+
+class ListDirEntry:
+    """The part of os.DirEntry used by the walker, for Python 2 without os.scandir."""
+
+    def __init__(self, dir_path, name):
+        self.name = name
+        self.path = os.path.join(dir_path, name)
+
+    def stat(self):
+        return os.stat(self.path)
+
+
+def scan_dir(path):
+    if hasattr(os, 'scandir'):
+        return list(os.scandir(path))
+    return [ListDirEntry(path, name) for name in os.listdir(path)]
+
+
+def stat_entry(entry):
+    # DirEntry caches the stat result, which is all the walker needs
+    mode = entry.stat().st_mode
     if not stat.S_ISDIR(mode):
         if not stat.S_ISREG(mode):
-            raise TrzszError('Not a regular file: %s' % path, trace=False)
-        if not os.access(path, os.R_OK):
-            raise TrzszError('No permission to read: %s' % path, trace=False)
-        file_list.append({'path_id': path_id, 'abs_path': path, 'path_name': rel_path, 'is_dir': False})
+            raise TrzszError('Not a regular file: %s' % entry.path, trace=False)
+        if not os.access(entry.path, os.R_OK):
+            raise TrzszError('No permission to read: %s' % entry.path, trace=False)
+    return entry.stat()
+
+
+def walk_path_readable(path_id, path, file_stat, pool=None):
+    base_dir = os.path.dirname(path)
+    root = PathNode(None, os.path.basename(path))
+    if not stat.S_ISDIR(file_stat.st_mode):
+        yield FileEntry(path_id, base_dir, root, False, file_stat.st_size)
         return
-    real_path = os.path.realpath(path)
-    if real_path in visited_dir:
-        raise TrzszError('Duplicate link: %s' % path, trace=False)
-    visited_dir.add(real_path)
-    file_list.append({'path_id': path_id, 'abs_path': path, 'path_name': rel_path, 'is_dir': True})
-    for file in os.listdir(path):
-        file_path = os.path.join(path, file)
-        rel_path_copy = rel_path[:]
-        rel_path_copy.append(file)
-        check_path_readable(path_id, file_path, os.stat(file_path).st_mode, file_list, rel_path_copy, visited_dir)
+    visited_dir = set()
+    # iterative, deep trees don't reach the recursion limit
+    stack = [(path, root)]
+    while stack:
+        dir_path, dir_node = stack.pop()
+        real_path = os.path.realpath(dir_path)
+        if real_path in visited_dir:
+            raise TrzszError('Duplicate link: %s' % dir_path, trace=False)
+        visited_dir.add(real_path)
+        yield FileEntry(path_id, base_dir, dir_node, True)
+        entries = scan_dir(dir_path)
+        stats = pool.map(stat_entry, entries) if pool and len(entries) > 1 else [stat_entry(e) for e in entries]
+        sub_dirs = []
+        for entry, entry_stat in zip(entries, stats):
+            if stat.S_ISDIR(entry_stat.st_mode):
+                sub_dirs.append((entry.path, PathNode(dir_node, entry.name)))
+            else:
+                yield FileEntry(path_id, base_dir, PathNode(dir_node, entry.name), False, entry_stat.st_size)
+        stack.extend(reversed(sub_dirs))
 
 
-def check_paths_readable(paths, directory):
-    file_list = []
-    for i, path in enumerate(paths):
+def walk_checked_paths(paths, pool):
+    try:
+        for i, (abs_path, file_stat) in enumerate(paths):
+            for file in walk_path_readable(i, abs_path, file_stat, pool):
+                yield file
+    finally:
+        if pool:
+            pool.close()
+
+
+def walk_paths_readable(paths, directory):
+    """Check the paths, and return an iterator of the files and directories, which walks the directories lazily."""
+    checked_paths = []
+    for path in paths:
         abs_path = os.path.abspath(path)
         if not os.path.exists(abs_path):
             raise TrzszError('No such file: %s' % abs_path, trace=False)
-        mode = os.stat(abs_path).st_mode
-        if not directory and stat.S_ISDIR(mode):
+        file_stat = os.stat(abs_path)
+        if not directory and stat.S_ISDIR(file_stat.st_mode):
             raise TrzszError('Is a directory: %s' % abs_path, trace=False)
-        visited_dir = set()
-        check_path_readable(i, abs_path, mode, file_list, [os.path.basename(abs_path)], visited_dir)
-    return file_list
+        if not stat.S_ISDIR(file_stat.st_mode):
+            stat_entry(ListDirEntry(os.path.dirname(abs_path), os.path.basename(abs_path)))
+        checked_paths.append((abs_path, file_stat))
+    pool = None
+    if STAT_THREADS > 0 and directory:
+        from multiprocessing.pool import ThreadPool  # pylint: disable=import-outside-toplevel
+        pool = ThreadPool(STAT_THREADS)
+    return walk_checked_paths(checked_paths, pool)
+
+
+def check_paths_readable(paths, directory):
+    return list(walk_paths_readable(paths, directory))
 
 
 def check_duplicate_names(files):
     names = set()
     for file in files:
-        path = os.path.join(*file['path_name'])
+        path = os.path.join(*file.path_name)
         if path in names:
             raise TrzszError('Duplicate name: %s' % path, trace=False)
         names.add(path)
@@ -662,7 +1186,7 @@ def check_tmux():
         GLOBAL.tmux_mode = TMUX_CONTROL_MODE
         return TMUX_CONTROL_MODE
 
-    GLOBAL.trzsz_writer = open(tmux_tty, 'w')  # pylint: disable=consider-using-with
+    GLOBAL.trzsz_writer = open(tmux_tty, 'wb', 0)  # pylint: disable=consider-using-with
     GLOBAL.tmux_mode = TMUX_NORMAL_MODE
 
     status_interval = get_tmux_status_interval()
@@ -704,6 +1228,21 @@ def reconfigure_stdin():
         pass
 
 
+class UniqueList(list):
+    """A list without duplicates, the lookups go through a set."""
+
+    __slots__ = ('seen', )
+
+    def __init__(self):
+        super(UniqueList, self).__init__()
+        self.seen = set()
+
+    def add(self, item):
+        if item not in self.seen:
+            self.seen.add(item)
+            self.append(item)
+
+
 def format_saved_files(file_list, dest_path):
     msg = 'Saved %d %s' % (len(file_list), 'files/directories' if len(file_list) > 1 else 'file/directory')
     if dest_path:
@@ -711,7 +1250,14 @@ def format_saved_files(file_list, dest_path):
     return '\r\n- '.join([msg] + file_list)
 
 
-def add_created_files(path):
+def add_created_files(path, is_dir=False):
+    # the paths in a created directory are deleted with it, and not kept
+    if os.path.dirname(path) in GLOBAL.created_dirs:
+        if is_dir:
+            GLOBAL.created_dirs.add(path)
+        return
+    if is_dir:
+        GLOBAL.created_dirs.add(path)
     GLOBAL.created_files.append(path)
 
 
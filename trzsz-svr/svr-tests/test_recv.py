@@ -115,6 +115,21 @@ class TestRecv(unittest.TestCase):
         self.assert_args_equal(['-y', '-d', '../adir'], overwrite=True, directory=True, path='../adir')
         self.assert_args_equal(['-eqt60', './bbb'], escape=True, quiet=True, timeout=60, path='./bbb')
 
+    def test_durability_args(self):
+        self.assertEqual('none', recv.parse_args([]).durability)
+        self.assertEqual('end', recv.parse_args(['--durability', 'end']).durability)
+        self.assertEqual('file', recv.parse_args(['--durability=file', '/tmp']).durability)
+        self.assert_args_raises(['--durability', 'always'], 'invalid choice')
+
+    def test_resume_args(self):
+        self.assertFalse(recv.parse_args([]).resume)
+        self.assertTrue(recv.parse_args(['--resume', '-y']).resume)
+
+    def test_sync_args(self):
+        self.assertFalse(recv.parse_args([]).sync)
+        self.assertTrue(recv.parse_args(['-d', '--sync', '/tmp']).sync)
+        self.assertTrue(recv.parse_args(['--sync', '--delta']).delta)
+
     def test_invalid_args(self):
         self.assert_args_raises(['-B', '2gb'], 'greater than 1G')
         self.assert_args_raises(['-B10'], 'less than 1K')
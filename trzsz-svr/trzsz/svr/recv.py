@@ -53,6 +53,28 @@ def parse_args(sys_args):
                         default=20,
                         metavar='N',
                         help='timeout ( N seconds ) for each buffer chunk.\nN <= 0 means never timeout. (default: 20)')
+    parser.add_argument('--digest',
+                        choices=sorted(utils.DIGEST_FACTORIES),
+                        default='md5',
+                        help='digest to verify the file(s), blake2b/crc32/adler32 are faster,\n'
+                        'none if another integrity check exists. (default: md5)')
+    parser.add_argument('--resume',
+                        action='store_true',
+                        help='resume the file(s) interrupted last time, keeping the received bytes\n'
+                        'whose digest matches. (implies no pipeline)')
+    parser.add_argument('--sync',
+                        action='store_true',
+                        help='skip the file(s) with the same size and mtime on the receiver,\n'
+                        'and overwrite the others. (implies -y)')
+    parser.add_argument('--delta',
+                        action='store_true',
+                        help='send only the changed parts of the file(s) existing on the receiver,\n'
+                        'like rsync. (implies -y, no pipeline, ignored with --resume)')
+    parser.add_argument('--durability',
+                        choices=[utils.DURABILITY_NONE, utils.DURABILITY_END, utils.DURABILITY_FILE],
+                        default=utils.DURABILITY_NONE,
+                        help='flush received file(s) to disk: never, before the final acknowledgement,\n'
+                        'or before acknowledging each file. (default: none)')
     parser.add_argument('path', nargs='?', default='.', help='path to save file(s). (default: current directory)')
     args = parser.parse_args(sys_args)
     if args.recursive is True:
@@ -76,6 +98,8 @@ def recv_files(args, dest_path):
 
     transfer.send_config(args, action, utils.get_escape_chars(args.escape))
 
+    utils.GLOBAL.durability = args.durability
+
     local_list = transfer.recv_files(dest_path, None)
 
     _ = transfer.recv_exit()
@@ -52,6 +52,23 @@ def parse_args(sys_args):
                         default=20,
                         metavar='N',
                         help='timeout ( N seconds ) for each buffer chunk.\nN <= 0 means never timeout. (default: 20)')
+    parser.add_argument('--digest',
+                        choices=sorted(utils.DIGEST_FACTORIES),
+                        default='md5',
+                        help='digest to verify the file(s), blake2b/crc32/adler32 are faster,\n'
+                        'none if another integrity check exists. (default: md5)')
+    parser.add_argument('--resume',
+                        action='store_true',
+                        help='resume the file(s) interrupted last time, keeping the received bytes\n'
+                        'whose digest matches. (implies no pipeline)')
+    parser.add_argument('--sync',
+                        action='store_true',
+                        help='skip the file(s) with the same size and mtime on the receiver,\n'
+                        'and overwrite the others. (implies -y)')
+    parser.add_argument('--delta',
+                        action='store_true',
+                        help='send only the changed parts of the file(s) existing on the receiver,\n'
+                        'like rsync. (implies -y, no pipeline, ignored with --resume)')
     parser.add_argument('file', nargs='+', type=utils.convert_to_unicode, help='file(s) to be sent')
     args = parser.parse_args(sys_args)
     if args.recursive is True:
@@ -73,7 +90,10 @@ def send_files(args, file_list):
     if args.directory and action.get('support_dir') is not True:
         raise utils.TrzszError("The client doesn't support transfer directory", trace=False)
 
-    transfer.send_config(args, action, [])
+    # the files in the directories are sent while walking them, if the client supports sending in batches
+    if not isinstance(file_list, list) and action.get('support_file_batches') is not True:
+        file_list = list(file_list)
+    transfer.send_config(args, action, [], len(file_list) if isinstance(file_list, list) else None)
 
     transfer.send_files(file_list, None)
 
@@ -84,7 +104,10 @@ def main():
     args = parse_args(sys.argv[1:])
 
     try:
-        file_list = utils.check_paths_readable(args.file, args.directory)
+        file_list = utils.walk_paths_readable(args.file, args.directory)
+        # the duplicate names are checked before sending, and the manifest of sync mode is built with all the files
+        if args.overwrite or args.sync or not args.directory:
+            file_list = list(file_list)
         if args.overwrite:
             utils.check_duplicate_names(file_list)
     except utils.TrzszError as ex: